@@ -0,0 +1,84 @@
+import pytest
+import typing as T
+import warnings
+
+
+class CoverageRelay:
+    """Relays the coverage measured in forked children back to the process that forked them,
+       rather than having each child write its own data file to be combined later.
+       A child measures its coverage in memory, with the configuration of the coverage that was
+       running when it was forked, and sends the data back with its reports; the parent merges
+       the data it receives and, at the end, adds it to its own coverage's data."""
+
+    def __init__(self, cov: "coverage.Coverage"):
+        self._cov = cov
+        self._data: T.Optional["coverage.CoverageData"] = None
+
+
+    @staticmethod
+    def create(config: pytest.Config) -> T.Optional["CoverageRelay"]:
+        """Returns a relay for the coverage currently running, if any."""
+        try:
+            import coverage
+        except ImportError:
+            raise pytest.UsageError("--cleanslate-coverage requires the coverage package")
+
+        if (cov := coverage.Coverage.current()) is None:
+            return None
+
+        return CoverageRelay(cov)
+
+
+    def start_child(self) -> None:
+        """Called in a newly forked child to start measuring its coverage."""
+        import coverage
+
+        # the coverage we inherited would only write its data (if at all) to the parent's file
+        self._cov.stop()
+
+        child_cov = coverage.Coverage(data_file=None)
+        child_cov.config = self._cov.config
+        child_cov.start()
+
+        self._cov = child_cov
+        self._data = None       # what we merged so far belongs to the parent
+
+
+    def finish_child(self) -> bytes:
+        """Called in a forked child when done, returning its coverage data (including that
+           relayed from its own children) for the parent to add()."""
+        self._cov.stop()
+        data = _get_data_quietly(self._cov)
+        if self._data:
+            data.update(self._data)
+
+        return data.dumps()
+
+
+    def add(self, dumped: bytes) -> None:
+        """Merges the coverage data received from a child."""
+        import coverage
+
+        child_data = coverage.CoverageData(no_disk=True)
+        child_data.loads(dumped)
+
+        if self._data is None:
+            self._data = coverage.CoverageData(no_disk=True)
+        self._data.update(child_data)
+
+
+    def merge(self) -> None:
+        """Adds the coverage data received from children to this process' coverage's data."""
+        if self._data:
+            _get_data_quietly(self._cov).update(self._data)
+            self._data = None
+
+
+def _get_data_quietly(cov: "coverage.Coverage") -> "coverage.CoverageData":
+    """Gets the coverage's data without its warnings about what it hasn't measured (yet), such as
+       that no data was collected, as what's measured is split among processes."""
+    import coverage
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", coverage.exceptions.CoverageWarning)
+        return cov.get_data()
@@ -0,0 +1,17 @@
+import pytest
+
+
+@pytest.hookspec
+def pytest_cleanslate_child_finished(item: pytest.Item, stats: dict) -> None:
+    """Called in the pytest process after each forked child finishes (or crashes).
+
+       `item` is the item the child ran (for tests run within an isolated module's child,
+       the module's item); `stats` includes:
+       - nodeid: the node ID of what the child ran;
+       - wall_time, cpu_time: the child's elapsed and (user + system) CPU time, in seconds;
+       - max_rss: the child's maximum resident set size, in kB;
+       - exit_status, signal: how the child exited (0 and 0 unless it crashed);
+       - reports: the number of reports it sent back;
+       - payload_size: the size, in bytes, of the (possibly compressed) payload it sent back;
+       as well as, where enabled, its memory usage (with --cleanslate-cow) and report sizes
+       (with --cleanslate-report-sizes)."""
@@ -0,0 +1,125 @@
+import pytest
+from pathlib import Path
+import hashlib
+import os
+import shlex
+import sys
+import typing as T
+
+
+CACHE_KEY = "cleanslate/incremental"
+
+
+def file_hash(path: Path) -> str:
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def invocation_args(config: pytest.Config, *, ignore: T.Iterable[str] = (),
+                    ignore_with_value: T.Iterable[str] = ()) -> T.List[str]:
+    """Returns pytest's effective arguments (those from the addopts ini option and PYTEST_ADDOPTS,
+       followed by the command line's), for telling whether results from another session apply,
+       without the options in `ignore` (those ending in '-' are prefixes) and those in
+       `ignore_with_value`, along with their values (as in "-k expr", "-kexpr" or "--deselect=id")."""
+    def ignored(name: str) -> bool:
+        return any(name == i or (i.endswith('-') and name.startswith(i)) for i in ignore)
+
+    args = []
+    skip_value = False
+    for arg in map(str, [*config.getini("addopts"), *shlex.split(os.environ.get("PYTEST_ADDOPTS", "")),
+                         *config.invocation_params.args]):
+        if skip_value:
+            skip_value = False
+            continue
+
+        name = arg.split('=', 1)[0]
+        if name in ignore_with_value:
+            skip_value = '=' not in arg
+        elif not (ignored(name) or any(len(o) == 2 and arg.startswith(o) for o in ignore_with_value)):
+            args.append(arg)
+
+    return args
+
+
+def get_inputs(item: pytest.Item) -> T.Dict[str, str]:
+    """Returns the project files that the module's outcome may depend on, and their hashes.
+       Meant to be called at the end of the module's forked child, so that the modules it
+       imported, as well as the conftests imported by the parent, are in sys.modules.
+       pytest's configuration file is included, wherever it is."""
+    root = item.config.rootpath
+    files = {item.path}
+    if (inipath := item.config.inipath):
+        files.add(inipath)
+    for module in list(sys.modules.values()):
+        if (f := getattr(module, '__file__', None)):
+            f = Path(f)
+            if root in f.parents and 'site-packages' not in f.parts:
+                files.add(f)
+
+    return {str(f.relative_to(root) if root in f.parents else f): file_hash(f) for f in files if f.exists()}
+
+
+class FileHashes:
+    """Memoizes the (current) hashes of project files, so that we can check whether they changed."""
+
+    def __init__(self, root: Path):
+        self._root = root
+        self._hashes = {}
+
+
+    def is_current(self, inputs: T.Dict[str, str]) -> bool:
+        """Checks whether the given files (relative to the root) still have the given hashes."""
+        for relpath, hash_ in inputs.items():
+            if relpath not in self._hashes:
+                try:
+                    self._hashes[relpath] = file_hash(self._root / relpath)
+                except OSError:
+                    self._hashes[relpath] = None
+
+            if self._hashes[relpath] != hash_:
+                return False
+
+        return True
+
+
+class IncrementalCache:
+    """Caches the reports of isolated test modules, keyed by their inputs: since each module runs
+       in a forked child, its outcome depends only on the files it imports and on pytest's
+       arguments (barring external resources, such as data files)."""
+
+    def __init__(self, config: pytest.Config, hashes: FileHashes, *, clear: bool = False):
+        self._config = config
+        self._hashes = hashes
+        self._entries = {} if clear else config.cache.get(CACHE_KEY, {})
+        self._args = invocation_args(config, ignore=("--cleanslate-cache", "--cleanslate-cache-clear"))
+        self.replayed = 0
+
+
+    def is_current(self, item: pytest.Item) -> bool:
+        """Checks whether the module's reports are cached and its inputs haven't changed."""
+        entry = self._entries.get(item.nodeid)
+        return bool(entry and entry['args'] == self._args and entry['python'] == sys.version
+                    and self._hashes.is_current(entry['inputs']))
+
+
+    def get(self, item: pytest.Item) -> T.Optional[list]:
+        """Returns the module's cached reports, if its inputs haven't changed."""
+        if not self.is_current(item):
+            return None
+
+        self.replayed += 1
+        return [self._config.hook.pytest_report_from_serializable(config=self._config, data=data)
+                for data in self._entries[item.nodeid]['reports']]
+
+
+    def put(self, item: pytest.Item, reports: list, inputs: T.Dict[str, str]) -> None:
+        self._entries[item.nodeid] = {
+            'args': self._args,
+            'python': sys.version,
+            'inputs': inputs,
+            'reports': [self._config.hook.pytest_report_to_serializable(config=self._config, report=rep)
+                        for rep in reports]
+        }
+
+
+    def save(self) -> None:
+        self._config.cache.set(CACHE_KEY, self._entries)
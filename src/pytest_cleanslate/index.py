@@ -0,0 +1,102 @@
+import pytest
+from pathlib import Path
+import json
+import typing as T
+import sys
+import warnings
+from .incremental import FileHashes, invocation_args
+
+
+CACHE_KEY = "cleanslate/index"
+
+
+def _is_simple(value) -> bool:
+    return value is None or isinstance(value, (str, int, float, bool))
+
+
+def index_entry(item: pytest.Item) -> dict:
+    """Describes a collected item well enough to select it with -k, -m or --deselect."""
+    # these are the names pytest's KeywordMatcher matches against
+    keywords = {node.name for node in item.listchain()
+                if not isinstance(node, pytest.Session)
+                   and not (isinstance(node, pytest.Directory) and isinstance(node.parent, pytest.Session))}
+    keywords.update(item.listextrakeywords())
+    if (function := getattr(item, "function", None)):
+        keywords.update(function.__dict__)
+
+    markers = [{'name': mark.name, 'kwargs': {k: v for k, v in mark.kwargs.items() if _is_simple(v)}}
+               for mark in item.iter_markers()]
+    keywords.update(m['name'] for m in markers)
+
+    return {
+        'nodeid': item.nodeid,
+        'type': type(item).__name__,
+        'markers': markers,
+        'keywords': sorted(keywords),
+    }
+
+
+class IndexedItem(pytest.Item):
+    """Stands for an item collected in a forked child, as described by its index entry."""
+    def __init__(self, *, entry: dict, **kwargs):
+        super().__init__(**kwargs)
+        self._type = entry['type']
+        with warnings.catch_warnings():
+            # any warnings about unregistered marks were issued when the module was collected
+            warnings.simplefilter("ignore", pytest.PytestUnknownMarkWarning)
+            for m in entry['markers']:
+                self.add_marker(getattr(pytest.mark, m['name'])(**m['kwargs']))
+        self.extra_keyword_matches.update(entry['keywords'])
+
+    def runtest(self):
+        raise RuntimeError("This should never execute")
+
+    def reportinfo(self):
+        return self.path, None, self.nodeid.split('::', 1)[-1]
+
+    def __repr__(self):
+        return f"<{self._type} {self.name}>"
+
+
+class CollectionIndex:
+    """Index of the items in each isolated test module, kept in pytest's cache.  Entries are keyed
+       by the module's node ID and are only used while the files it imported and pytest's
+       configuration file are unchanged, and for the same effective pytest arguments (as plugins
+       may collect or parametrize based on them), other than those that only select among the
+       items, and Python version."""
+
+    # options that select among the items collected, or otherwise don't affect collection
+    IGNORED_OPTIONS = ("--cleanslate-", "--collect-only", "--co")
+    SELECTION_OPTIONS = ("-k", "-m", "--deselect")
+
+    def __init__(self, config: pytest.Config, hashes: FileHashes):
+        self._config = config
+        self._hashes = hashes
+        self._entries = config.cache.get(CACHE_KEY, {})
+        self._args = invocation_args(config, ignore=self.IGNORED_OPTIONS, ignore_with_value=self.SELECTION_OPTIONS)
+        self._changed = False
+
+
+    @staticmethod
+    def read(cache_dir: Path) -> T.Dict[str, dict]:
+        """Reads the index from the given pytest cache directory, for use by other tools."""
+        with (cache_dir / "v" / CACHE_KEY).open("r") as f:
+            return json.load(f)
+
+
+    def get(self, nodeid: str) -> T.Optional[T.List[dict]]:
+        """Returns the module's item entries, unless absent or stale."""
+        if ((entry := self._entries.get(nodeid)) and entry.get('args') == self._args
+            and entry.get('python') == sys.version and self._hashes.is_current(entry['inputs'])):
+            return entry['items']
+        return None
+
+
+    def put(self, nodeid: str, inputs: T.Dict[str, str], items: T.List[dict]) -> None:
+        self._entries[nodeid] = {'args': self._args, 'python': sys.version, 'inputs': inputs, 'items': items}
+        self._changed = True
+
+
+    def save(self) -> None:
+        if self._changed:
+            self._config.cache.set(CACHE_KEY, self._entries)
@@ -1,5 +1,20 @@
 import pytest
 from pathlib import Path
+import gc
+import itertools
+import json
+import signal
+import sys
+import time
+import typing as T
+import zlib
+from .coverage_relay import CoverageRelay
+from .incremental import FileHashes, IncrementalCache, get_inputs
+from .index import CollectionIndex, IndexedItem, index_entry
+from .preload import ImportTracker, Preloads
+from .reports import iter_reports, report_sizes, shrink_reports
+from .restore import NeedsFork, Snapshot
+from .scheduler import Scheduler
 
 
 # py.process.ForkedFunc does os.close(1) and os.close(2) just before
@@ -25,6 +40,139 @@ class IgnoreOsCloseErrors:
         os.close = self.original_os_close
 
 
+# GC thresholds for children in --cleanslate-cow mode: they're short lived, so collecting
+# less often saves time without much risk of running out of memory.
+CHILD_GC_THRESHOLD = (10_000, 20, 20)
+
+child_stats_key = pytest.StashKey[dict]()
+child_start_key = pytest.StashKey[float]()
+module_data_key = pytest.StashKey[dict]()
+
+
+def _memory_usage() -> dict:
+    """Returns this process' memory usage (in kB), if available from /proc."""
+    try:
+        with open("/proc/self/smaps_rollup", "r") as f:
+            fields = {name: int(value.split()[0]) for name, value in (line.split(':', 1) for line in f)
+                      if value.strip().endswith('kB')}
+    except OSError:
+        return {}
+
+    return {
+        'rss': fields['Rss'],
+        'pss': fields['Pss'],
+        'uss': fields['Private_Clean'] + fields['Private_Dirty'],
+        'shared': fields['Shared_Clean'] + fields['Shared_Dirty'],
+    }
+
+
+def _fork(item: pytest.Item, func: T.Callable[[], T.Any]) -> "py.process.ForkedFunc":
+    """Starts executing `func` in a forked child process; use _wait_forked() to obtain the result."""
+    import pickle
+    import py                   # FIXME py is maintenance only
+
+    config = item.config
+    cow = config.getoption("cleanslate_cow")
+    plugin = config.pluginmanager.get_plugin("cleanslate_plugin")
+    coverage = plugin._coverage if plugin is not None else None
+    # tests run in a module's child's own children may import more of its inputs
+    track_inputs = plugin is not None and plugin._in_module_child and bool(plugin._cache or plugin._index)
+
+    def runforked():
+        if cow:
+            gc.set_threshold(*CHILD_GC_THRESHOLD)
+        if coverage:
+            coverage.start_child()
+
+        retval = func()
+        stats = _memory_usage() if cow else {}
+
+        reports = list(iter_reports(retval))
+        shrink_reports(config, reports)
+        if config.getoption("cleanslate_report_sizes"):
+            stats['report_sizes'] = report_sizes(reports)
+
+        payload = pickle.dumps((retval, stats, coverage.finish_child() if coverage else None,
+                                get_inputs(item) if track_inputs else None, time.perf_counter()))
+        return zlib.compress(payload, 1) if config.getoption("cleanslate_compress") else payload
+
+    if cow:
+        # move everything to the permanent generation, so that the children's garbage
+        # collection doesn't write to (and thus copy) the pages it shares with us
+        gc.freeze()
+
+    try:
+        item.stash[child_start_key] = time.perf_counter()
+        with IgnoreOsCloseErrors():
+            return py.process.ForkedFunc(runforked)
+    finally:
+        if cow:
+            gc.unfreeze()
+
+
+def _wait_forked(item: pytest.Item, ff: "py.process.ForkedFunc") -> T.Any:
+    """Waits for a child started with _fork(), returning what its function returned (or raising
+       it, if an exception), or a crash report list if the child died.
+       Statistics about the child are saved in the item's stash and passed to
+       pytest_cleanslate_child_finished."""
+    import pickle
+    import pytest_forked as ptf # FIXME pytest-forked is unmaintained
+
+    rusage = None
+    def wait4(pid, options):
+        nonlocal rusage
+        pid, status, rusage = os.wait4(pid, options)
+        return pid, status
+
+    result = ff.waitfinish(waiter=wait4)
+    finished = time.perf_counter()
+    plugin = item.config.pluginmanager.get_plugin("cleanslate_plugin")
+    stats = {
+        'nodeid': item.nodeid,
+        'cpu_time': rusage.ru_utime + rusage.ru_stime,
+        'max_rss': rusage.ru_maxrss // 1024 if sys.platform == 'darwin' else rusage.ru_maxrss,
+        'exit_status': result.exitstatus,
+        'signal': result.signal,
+        'payload_size': len(result.retval) if result.retval is not None else 0,
+    }
+
+    if result.retval is None:
+        retval = [ptf.report_process_crash(item, result)]
+    else:
+        payload = result.retval
+        if item.config.getoption("cleanslate_compress"):
+            payload = zlib.decompress(payload)
+
+        # children started ahead of their turn may be reaped long after they finished, so we
+        # go by when the child says it finished (perf_counter()'s clock is system-wide)
+        retval, child_stats, coverage_data, inputs, finished = pickle.loads(payload)
+        stats.update(child_stats)
+        if coverage_data is not None:
+            plugin._coverage.add(coverage_data)
+        if inputs:
+            plugin._grandchild_inputs.update(inputs)
+
+    stats['wall_time'] = finished - item.stash[child_start_key]
+    stats['reports'] = sum(1 for _ in iter_reports(retval))
+    item.stash[child_stats_key] = stats
+
+    if plugin is not None and plugin._in_module_child:
+        # relayed to the parent along with the module's reports
+        plugin._grandchild_stats.append(stats)
+    else:
+        item.ihook.pytest_cleanslate_child_finished(item=item, stats=stats)
+
+    if isinstance(retval, BaseException):
+        raise retval
+
+    return retval
+
+
+def _run_forked(item: pytest.Item, func: T.Callable[[], T.Any]) -> T.Any:
+    """Executes `func` in a forked child process; see _wait_forked()."""
+    return _wait_forked(item, _fork(item, func))
+
+
 class CleanSlateItem(pytest.Item):
     """Item that stands for a Module until it can be collected from its forked subprocess"""
     def __init__(self, **kwargs):
@@ -33,35 +181,134 @@ class CleanSlateItem(pytest.Item):
     def runtest(self):
         raise RuntimeError("This should never execute")
 
+    def _collect(self) -> T.List[pytest.Item]:
+        # Use 'parent' as it would have been in pytest_pycollect_makemodule, so that our
+        # nodes aren't included in the chain, as they might confuse other plugins (such as 'mark')
+        module = pytest.Module.from_parent(parent=self.parent.parent, path=self.path)
+
+        def collect_items(collector):
+            for it in collector.collect():
+                if isinstance(it, pytest.Collector):
+                    yield from collect_items(it)
+                else:
+                    yield it
+
+        return list(collect_items(module))
+
+    def _collection_failure(self, nodeid: str) -> T.List[pytest.CollectReport]:
+        excinfo = pytest.ExceptionInfo.from_current()
+        return [pytest.CollectReport(
+                    nodeid=nodeid,
+                    outcome='failed',
+                    result=None,
+                    longrepr=self._repr_failure_py(excinfo, "short"))
+        ]
+
+    def start_indexing(self) -> "py.process.ForkedFunc":
+        """Starts collecting the module in a forked child; see finish_indexing()."""
+        def runforked():
+            try:
+                items = self._collect()
+            except BaseException:
+                return self._collection_failure(self.parent.nodeid)
+
+            return [index_entry(it) for it in items], get_inputs(self)
+
+        return _fork(self, runforked)
+
+    def finish_indexing(self, ff: "py.process.ForkedFunc") -> T.Union[T.Tuple[list, dict], list]:
+        """Returns the module's index entries and inputs, or its collection failure reports."""
+        return _wait_forked(self, ff)
+
+    def run_in_process(self) -> T.Optional[list]:
+        """Collects and runs the module in this process, rolling back its changes to the
+           interpreter state afterwards; returns None if it must be forked instead."""
+        plugin = self.parent.plugin
+        data = self.stash[module_data_key] = {}
+        snapshot = Snapshot()
+        session_items = self.session.items
+        try:
+            try:
+                items = self._collect()
+            except BaseException:
+                return self._collection_failure(self.nodeid)
+
+            if any(it.get_closest_marker("cleanslate_fork") for it in items):
+                return None
+
+            if plugin._index:
+                data['index'] = [index_entry(it) for it in items]
+
+            pm = self.config.pluginmanager
+            self.session.items = items
+            caller = pm.subset_hook_caller('pytest_collection_modifyitems', remove_plugins=[plugin])
+            caller(session=self.session, config=self.config, items=items)
+
+            # through the hook, so that other plugins' protocols (such as for timeouts or reruns)
+            # apply; it logs the reports as they come, so they're marked as already logged.
+            reports = []
+            class ReportSaver:
+                @pytest.hookimpl
+                def pytest_runtest_logreport(self, report):
+                    reports.append(report)
+
+            saver = ReportSaver()
+            pm.register(saver)
+            data['logged'] = True
+            try:
+                protocol = pm.subset_hook_caller('pytest_runtest_protocol', remove_plugins=[plugin])
+                for i, item in enumerate(items):
+                    nextitem = items[i+1] if i+1 < len(items) else None
+                    protocol(item=item, nextitem=nextitem)
+                    if self.session.shouldfail or self.session.shouldstop:
+                        break
+            finally:
+                pm.unregister(saver)
+
+            return reports
+        finally:
+            self.session.items = session_items
+            # after running, as the tests may import more
+            if plugin._cache or plugin._index:
+                data['inputs'] = get_inputs(self)
+            if (problems := snapshot.restore()):
+                plugin._needs_fork.add(self.nodeid, problems)
+
     def collect_and_run(self):
-        # adapted from pytest-forked
-        import pickle
-        import _pytest
-        import pytest_forked as ptf # FIXME pytest-forked is unmaintained
-        import py                   # FIXME py is maintenance only
+        plugin = self.parent.plugin
+        if (self.config.getoption("cleanslate_mode") == 'restore' and self.nodeid not in plugin._needs_fork
+            and self.parent.nodeid not in plugin._polluter_modules
+            and (reports := self.run_in_process()) is not None):
+            return reports
+
+        return self.finish_run(self.start_run())
 
+    def start_run(self) -> "py.process.ForkedFunc":
+        """Starts collecting and running the module in a forked child; see finish_run()."""
+        # adapted from pytest-forked
         def runforked():
-            # Use 'parent' as it would have been in pytest_pycollect_makemodule, so that our
-            # nodes aren't included in the chain, as they might confuse other plugins (such as 'mark')
-            module = pytest.Module.from_parent(parent=self.parent.parent, path=self.path)
+            self.parent.plugin._in_module_child = True
+
+            plugin = self.parent.plugin
+            data = {}  # information about the module, only available in the child
 
-            def collect_items(collector):
-                for it in collector.collect():
-                    if isinstance(it, pytest.Collector):
-                        yield from collect_items(it)
-                    else:
-                        yield it
+            def get_data():
+                if plugin._cache or plugin._index:
+                    data['inputs'] = {**plugin._grandchild_inputs, **get_inputs(self)}
+                data['children'] = plugin._grandchild_stats
+                return data
 
+            tracker = ImportTracker() if plugin._preloads else None
             try:
-                self.session.items = list(collect_items(module))
+                self.session.items = self._collect()
             except BaseException:
-                excinfo = pytest.ExceptionInfo.from_current()
-                return pickle.dumps([pytest.CollectReport(
-                            nodeid=self.nodeid,
-                            outcome='failed',
-                            result=None,
-                            longrepr=self._repr_failure_py(excinfo, "short"))
-                ])
+                return self._collection_failure(self.nodeid), get_data()
+            finally:
+                if tracker:
+                    data['imports'] = tracker.stop()
+
+            if plugin._index:
+                data['index'] = [index_entry(it) for it in self.session.items]
 
             pm = self.config.pluginmanager
             caller = pm.subset_hook_caller('pytest_collection_modifyitems', remove_plugins=[self.parent.plugin])
@@ -80,20 +327,17 @@ class CleanSlateItem(pytest.Item):
             except (pytest.Session.Interrupted, pytest.Session.Failed):
                 pass
             except BaseException as e:
-                return pickle.dumps(e)
+                return e
 
-            return pickle.dumps(reports)
+            return reports, get_data()
 
-        with IgnoreOsCloseErrors():
-            ff = py.process.ForkedFunc(runforked)
-        result = ff.waitfinish()
+        return _fork(self, runforked)
 
-        if result.retval is None:
-            return [ptf.report_process_crash(self, result)]
-
-        retval = pickle.loads(result.retval)
-        if isinstance(retval, BaseException):
-            raise retval
+    def finish_run(self, ff: "py.process.ForkedFunc") -> list:
+        """Returns the module's reports (or crash report), saving its data in the stash."""
+        retval = _wait_forked(self, ff)
+        if isinstance(retval, tuple):
+            retval, self.stash[module_data_key] = retval
 
         return retval
 
@@ -109,34 +353,79 @@ class CleanSlateCollector(pytest.File, pytest.Collector):
 
 def run_item_forked(item):
     import _pytest.runner
-    import pytest_forked as ptf # FIXME pytest-forked is unmaintained
-    import py                   # FIXME py is maintenance only
-    import pickle
 
     def runforked():
         try:
-            return pickle.dumps(_pytest.runner.runtestprotocol(item, log=False))
+            return _pytest.runner.runtestprotocol(item, log=False)
         except BaseException as e:
-            return pickle.dumps(e)
+            return e
 
-    ff = py.process.ForkedFunc(runforked)
-    result = ff.waitfinish()
+    return _run_forked(item, runforked)
 
-    if result.retval is None:
-        return [ptf.report_process_crash(item, result)]
 
-    retval = pickle.loads(result.retval)
+def run_items_forked(items: T.List[pytest.Item]) -> T.Union[T.Dict[int, list], list]:
+    """Runs the given items in a single forked child, returning their reports by index in
+       the list (items not run, such as after reaching --maxfail, are omitted), or a crash
+       report list if the child died."""
+    import _pytest.runner
 
-    if isinstance(retval, BaseException):
-        raise retval
+    def runforked():
+        maxfail = items[0].config.getoption("maxfail")
+        failures = 0
+        reports = {}
+        try:
+            for i, item in enumerate(items):
+                nextitem = items[i+1] if i+1 < len(items) else None
+                reports[i] = _pytest.runner.runtestprotocol(item, log=False, nextitem=nextitem)
+                failures += any(rep.failed for rep in reports[i])
+                if maxfail and failures >= maxfail:
+                    break
+        except BaseException as e:
+            return e
 
-    return retval
+        return reports
+
+    return _run_forked(items[0], runforked)
+
+
+def _get_batch(items: T.List[pytest.Item], position: int, scope: str) -> T.List[pytest.Item]:
+    """Returns the items, starting with the one at the given position, to run together in the same batch."""
+    def key(it):
+        return it.path if scope == 'file' else it.parent
+
+    item = items[position]
+    batch = [item]
+    for it in itertools.islice(items, position+1, None):
+        if isinstance(it, CleanSlateItem) or key(it) != key(item):
+            break
+        batch.append(it)
+
+    return batch
 
 
 class CleanSlatePlugin:
     """Pytest plugin to isolate test collection, so that if a test's collection pollutes the in-memory
        state, it doesn't affect the execution of other tests."""
 
+    def __init__(self):
+        self._child_stats = []
+        self._batched_reports = {}
+        self._unbatched: T.Set[pytest.Item] = set()    # from batches that crashed
+        self._position = 0      # of the last item looked up in session.items
+        self._in_module_child = False
+        self._grandchild_stats = []
+        self._grandchild_inputs: T.Dict[str, str] = {}
+        self._cache = None
+        self._index = None
+        self._standins = {}
+        self._needs_fork = None
+        self._polluter_modules: T.Set[str] = set()
+        self._scheduler = None
+        self._coverage: T.Optional[CoverageRelay] = None
+        self._preloads: T.Optional[Preloads] = None
+        self._running: T.Dict[CleanSlateItem, "py.process.ForkedFunc"] = {}    # started ahead
+        self._finished: T.Dict[CleanSlateItem, T.Union[list, BaseException]] = {}
+
 
     @pytest.hookimpl(tryfirst=True)
     def pytest_pycollect_makemodule(self, module_path: Path, parent):
@@ -148,22 +437,113 @@ class CleanSlatePlugin:
         ihook = item.ihook
         ihook.pytest_runtest_logstart(nodeid=item.nodeid, location=item.location)
         if isinstance(item, CleanSlateItem):
-            reports = item.collect_and_run()
+            if not self._cache or (reports := self._cache.get(item)) is None:
+                reports = self._run_scheduled(item) if self._scheduler else item.collect_and_run()
+                data = item.stash.get(module_data_key, {})
+                if self._cache and 'inputs' in data:
+                    self._cache.put(item, reports, data['inputs'])
+                if self._index and 'index' in data:
+                    self._index.put(item.parent.nodeid, data['inputs'], data['index'])
+                if self._preloads and 'imports' in data:
+                    self._preloads.record(data['imports'])
+                for stats in data.get('children', ()):
+                    item.ihook.pytest_cleanslate_child_finished(item=item, stats=stats)
+        elif item in self._batched_reports:
+            reports = self._batched_reports.pop(item)
+        elif ((scope := item.config.getoption("cleanslate_batch")) != 'item' and not self._in_module_child
+              and item not in self._unbatched):
+            # items not from Python modules (such as doctests) run in batches; in the
+            # unlikely event that the batch crashes, we rerun its items individually.
+            batch = _get_batch(item.session.items, self._position_of(item), scope)
+            if len(batch) > 1:
+                if isinstance(batch_reports := run_items_forked(batch), dict):
+                    self._batched_reports.update({batch[i]: r for i, r in batch_reports.items()})
+                else:
+                    self._unbatched.update(batch)
+
+            reports = self._batched_reports.pop(item, None) or run_item_forked(item)
         else:
             # note any side effects, such as setting session.shouldstop, are lost...
             reports = run_item_forked(item)
 
+        if (stats := item.stash.get(child_stats_key, None)):
+            self._child_stats.append((item.nodeid, stats))
+
         if (reports and isinstance(reports[0], pytest.CollectReport) and reports[0].outcome == 'failed'
             and not item.config.option.continue_on_collection_errors):
             item.session.shouldstop = 'collection error'
 
-        for rep in reports:
-            ihook.pytest_runtest_logreport(report=rep)
+        if not (isinstance(item, CleanSlateItem) and item.stash.get(module_data_key, {}).get('logged')):
+            for rep in reports:
+                ihook.pytest_runtest_logreport(report=rep)
 
         ihook.pytest_runtest_logfinish(nodeid=item.nodeid, location=item.location)
         return True
 
 
+    def _run_scheduled(self, item: CleanSlateItem) -> list:
+        """Runs the module's child, starting those of upcoming modules as the scheduler admits them."""
+        while item not in self._running and item not in self._finished:
+            if self._scheduler.admit(item.nodeid, {it.nodeid: ff.pid for it, ff in self._running.items()}):
+                self._running[item] = item.start_run()
+            else:
+                self._finish(next(iter(self._running)))    # wait for the oldest
+
+        self._start_ahead(item)
+
+        if item in self._running:
+            self._finish(item)
+
+        if isinstance(result := self._finished.pop(item), BaseException):
+            raise result
+
+        return result
+
+
+    def _position_of(self, item: pytest.Item) -> int:
+        """Returns the item's position in the session's items; as they run in order,
+           it's searched for starting from the previous position found."""
+        items = item.session.items
+        try:
+            self._position = items.index(item, self._position)
+        except ValueError:
+            self._position = items.index(item)
+
+        return self._position
+
+
+    def _start_ahead(self, item: CleanSlateItem) -> None:
+        items = item.session.items
+        jobs = item.config.getoption("cleanslate_jobs")
+        start = self._position_of(item) + 1
+        for upcoming in items[start:start + 2*jobs]:
+            if (not isinstance(upcoming, CleanSlateItem) or upcoming in self._running
+                or upcoming in self._finished or (self._cache and self._cache.is_current(upcoming))):
+                continue
+
+            if not self._scheduler.admit(upcoming.nodeid, {it.nodeid: ff.pid for it, ff in self._running.items()}):
+                continue    # a lighter module further ahead may still fit
+
+            self._running[upcoming] = upcoming.start_run()
+
+
+    def _finish(self, item: CleanSlateItem) -> None:
+        try:
+            self._finished[item] = item.finish_run(self._running[item])
+        except Exception as e:
+            self._finished[item] = e
+        except BaseException as e:
+            if child_stats_key not in item.stash:
+                # interrupted while waiting; the children are killed at the end of the session
+                raise
+            self._finished[item] = e    # relayed from the child, so raised in its turn
+
+        del self._running[item]
+
+        if (max_rss := item.stash.get(child_stats_key, {}).get('max_rss')):
+            self._scheduler.record(item.nodeid, max_rss)
+
+
     @pytest.hookimpl(tryfirst=True, hookwrapper=True)
     def pytest_collection_modifyitems(self, session, config, items):
         # Since we're deferring collection to CleanSlateItem, we won't have
@@ -172,16 +552,255 @@ class CleanSlatePlugin:
         # There doesn't seem to be a way to prevent other plugins from modifying
         # the list, so we save it, let them run, and restore it.
         initial_items = list(items) # TODO save them using pytest_deselected() instead?
+        if config.option.collectonly:
+            # Replace our items with (stand-ins for) the actual ones, so that they're
+            # listed and other plugins can select from them.
+            items[:] = self._collect_isolated(session, items)
+            yield
+            return
+
+        # Where the index is current, let other plugins see stand-ins for the actual items,
+        # so that we can skip modules none of whose items are selected (such as with -k or -m).
+        self._standins = {}
+        if self._index:
+            for item in items:
+                if (isinstance(item, CleanSlateItem) and
+                    (entries := self._index.get(item.parent.nodeid)) is not None):
+                    self._standins[item] = [IndexedItem.from_parent(item.parent, name=e['nodeid'].split('::', 1)[-1],
+                                                                    nodeid=e['nodeid'], entry=e)
+                                            for e in entries]
+            items[:] = [standin for item in items for standin in self._standins.get(item, [item])]
+
+        yield
+
+        remaining = set(items)
+        skipped = [item for item in initial_items
+                   if item in self._standins and not any(s in remaining for s in self._standins[item])]
+        skipped_set = set(skipped)
+        items[:] = [item for item in initial_items if item not in skipped_set]
+        self._standins = {}
+        if skipped:
+            config.hook.pytest_deselected(items=skipped)
+
+
+    @pytest.hookimpl(tryfirst=True, hookwrapper=True)
+    def pytest_deselected(self, items):
+        # The stand-ins aren't counted as collected, so we report their modules instead, if skipped.
+        if self._standins:
+            items[:] = [item for item in items if not isinstance(item, IndexedItem)]
+        yield
+
+
+    def _collect_isolated(self, session: pytest.Session, items: T.List[pytest.Item]) -> T.List[pytest.Item]:
+        """Collects modules in (concurrent) forked children, or from the index if current."""
+        from collections import deque
+
+        entries = {}
+        pending = deque()
+
+        def finish_oldest():
+            item, ff = pending.popleft()
+            if isinstance(retval := item.finish_indexing(ff), tuple):
+                entries[item], inputs = retval
+                if self._index:
+                    self._index.put(item.parent.nodeid, inputs, entries[item])
+            else:
+                for rep in retval:
+                    if not isinstance(rep, pytest.CollectReport): # crashed
+                        rep = pytest.CollectReport(nodeid=item.parent.nodeid, outcome='failed',
+                                                  result=None, longrepr=rep.longrepr)
+                    session.config.hook.pytest_collectreport(report=rep)
+
+        jobs = session.config.getoption("cleanslate_jobs")
+        for item in items:
+            if isinstance(item, CleanSlateItem):
+                if self._index and (item_entries := self._index.get(item.parent.nodeid)) is not None:
+                    entries[item] = item_entries
+                else:
+                    if len(pending) >= jobs:
+                        finish_oldest()
+                    pending.append((item, item.start_indexing()))
+
+        while pending:
+            finish_oldest()
+
+        collected = []
+        for item in items:
+            if not isinstance(item, CleanSlateItem):
+                collected.append(item)
+            else:
+                collected.extend(IndexedItem.from_parent(item.parent, name=e['nodeid'].split('::', 1)[-1],
+                                                         nodeid=e['nodeid'], entry=e)
+                                 for e in entries.get(item, ()))
+
+        return collected
+
+
+    @pytest.hookimpl
+    def pytest_sessionstart(self, session):
+        config = session.config
+        has_cache = getattr(config, "cache", None) is not None
+        hashes = FileHashes(config.rootpath)
+
+        if config.getoption("cleanslate_cache"):
+            if not has_cache:
+                raise pytest.UsageError("--cleanslate-cache requires the cacheprovider plugin")
+            self._cache = IncrementalCache(config, hashes, clear=config.getoption("cleanslate_cache_clear"))
+
+        # keeping the index up to date costs hashing, in each child, the project files it imported
+        if has_cache and (config.getoption("collectonly") or config.getoption("cleanslate_index")):
+            self._index = CollectionIndex(config, hashes)
+
+        self._needs_fork = NeedsFork(config)
+
+        if (dependencies_file := config.getoption("cleanslate_dependencies")):
+            with dependencies_file.open("r") as f:
+                dependencies = json.load(f)
+            # modules with known polluters are always forked, as restoring may miss what they change
+            self._polluter_modules = {nodeid.split('::')[0] for dep in dependencies.get('dependencies', ())
+                                      if dep['kind'] == 'polluter' for nodeid in dep['tests']}
+
+        if config.getoption("cleanslate_parallel") and config.getoption("cleanslate_mode") == 'fork':
+            self._scheduler = Scheduler(config, max_jobs=config.getoption("cleanslate_jobs"))
+
+        if config.getoption("cleanslate_coverage"):
+            self._coverage = CoverageRelay.create(config)
+
+        if config.getoption("cleanslate_preload") or config.getoption("cleanslate_preload_report"):
+            self._preloads = Preloads(config)
+            if config.getoption("cleanslate_preload"):
+                self._preloads.preload()
+
+
+    @pytest.hookimpl(hookwrapper=True, trylast=True)
+    def pytest_runtestloop(self, session):
         yield
-        items[:] = initial_items
+        # before coverage plugins (such as pytest-cov's) save the data
+        if self._coverage:
+            self._coverage.merge()
+
+
+    @pytest.hookimpl
+    def pytest_sessionfinish(self, session, exitstatus):
+        if self._cache:
+            self._cache.save()
+        if self._index:
+            self._index.save()
+        self._needs_fork.save()
+        if self._preloads:
+            self._preloads.save()
+
+        if self._scheduler:
+            # children started ahead of a stop (such as with -x) are no longer needed
+            for item, ff in self._running.items():
+                os.kill(ff.pid, signal.SIGKILL)
+                ff.waitfinish()
+            self._running.clear()
+            self._scheduler.save()
+
+
+    @pytest.hookimpl
+    def pytest_terminal_summary(self, terminalreporter, exitstatus, config):
+        tr = terminalreporter
+        if self._cache and self._cache.replayed:
+            tr.write_line(f"cleanslate: replayed {self._cache.replayed} unchanged module(s) from cache")
+
+        for nodeid, problems in self._needs_fork.new.items():
+            tr.write_line(f"cleanslate: couldn't roll back {nodeid} ({'; '.join(problems)});"
+                          " it will be forked from now on")
+
+        if self._preloads:
+            if self._preloads.preloaded:
+                tr.write_line(f"cleanslate: preloaded {', '.join(self._preloads.preloaded)}")
+            for name, error in self._preloads.failed.items():
+                tr.write_line(f"cleanslate: couldn't preload {name} ({error})")
+
+        if (count := config.getoption("cleanslate_preload_report")) and self._preloads.modules:
+            tr.section("cleanslate preload recommendations")
+            for name, stats in self._preloads.recommendations()[:count]:
+                tr.write_line(f"{name}: imported by {stats['modules']} module(s),"
+                              f" taking {stats['time']/stats['timed']:.3f}s")
+            for name, changes in self._preloads.unsafe().items():
+                tr.write_line(f"{name}: not recommended, as importing it changed {'; '.join(changes)}")
+
+        if (count := config.getoption("cleanslate_report_sizes")):
+            sizes = [size for _, stats in self._child_stats for size in stats.get('report_sizes', ())]
+            if sizes:
+                tr.section("cleanslate largest reports")
+                for nodeid, when, size in sorted(sizes, key=lambda s: -s[2])[:count]:
+                    tr.write_line(f"{size/1024:10.1f} KiB  {nodeid} ({when})")
+
+        memory_stats = [(nodeid, stats) for nodeid, stats in self._child_stats if 'uss' in stats]
+        if not config.getoption("cleanslate_cow") or not memory_stats:
+            return
+
+        def mib(kb):
+            return f"{kb/1024:.1f} MiB"
+
+        tr.section("cleanslate memory usage")
+        for nodeid, stats in sorted(memory_stats, key=lambda s: -s[1]['uss']):
+            tr.write_line(f"{nodeid}: USS {mib(stats['uss'])}, PSS {mib(stats['pss'])}, "
+                          f"shared {mib(stats['shared'])}")
+        tr.write_line(f"total USS {mib(sum(s['uss'] for _, s in memory_stats))} "
+                      f"in {len(memory_stats)} children")
+
+
+def pytest_addhooks(pluginmanager: pytest.PytestPluginManager) -> None:
+    from . import hooks
+    pluginmanager.add_hookspecs(hooks)
 
 
 def pytest_addoption(parser: pytest.Parser, pluginmanager: pytest.PytestPluginManager) -> None:
     g = parser.getgroup('cleanslate')
     g.addoption("--cleanslate", action="store_true",
                 help="Isolate test module collection and test execution using sys.fork()")
+    g.addoption("--cleanslate-mode", choices=['fork', 'restore'], default='fork',
+                help="How to isolate test modules: run each in a forked child (default), or run them"
+                     " in this process, rolling back the interpreter state they change afterwards;"
+                     " modules marked cleanslate_fork, or whose changes couldn't be rolled back, are forked")
+    g.addoption("--cleanslate-dependencies", type=Path, metavar="FILE",
+                help="Dependency map, as saved by cleanslate-reduce --discover; with --cleanslate-mode=restore,"
+                     " modules with known polluters are forked")
+    g.addoption("--cleanslate-cow", action="store_true",
+                help="Freeze the garbage collector before forking, so that children share more memory"
+                     " with the parent (copy-on-write), and report their memory usage")
+    g.addoption("--cleanslate-batch", choices=['item', 'parent', 'file'], default='item',
+                help="How to group items not in Python modules (such as doctests) into forked children:"
+                     " one child per item (default), per parent collector or per file")
+    g.addoption("--cleanslate-jobs", type=int, default=os.cpu_count(),
+                help="Maximum number of forked children to run concurrently, where possible"
+                     " (such as when collecting with --collect-only, or with --cleanslate-parallel)")
+    g.addoption("--cleanslate-parallel", action="store_true",
+                help="Run isolated modules' children concurrently, starting each as the system's load"
+                     " and available memory allow, based on the module's peak memory use in earlier runs")
+    g.addoption("--cleanslate-coverage", action="store_true",
+                help="When measuring coverage (such as with pytest-cov or coverage run), send the coverage"
+                     " measured in forked children back to this process, which merges it into its data")
+    g.addoption("--cleanslate-preload", action="store_true",
+                help="Import the third-party packages that earlier runs found most modules import"
+                     " before forking, so that the children share them rather than each importing them")
+    g.addoption("--cleanslate-preload-report", type=int, default=0, metavar="N",
+                help="Show the N third-party packages most worth preloading, based on what the modules"
+                     " import, saving them for --cleanslate-preload")
+    g.addoption("--cleanslate-max-section", type=int, default=0, metavar="CHARS",
+                help="Truncate captured output sections longer than this in reports from forked children,"
+                     " saving the full output to a file in pytest's cache")
+    g.addoption("--cleanslate-compress", action="store_true",
+                help="Compress the reports sent back from forked children")
+    g.addoption("--cleanslate-report-sizes", type=int, default=0, metavar="N",
+                help="Show the N largest reports sent back from forked children")
+    g.addoption("--cleanslate-cache", action="store_true",
+                help="Replay the results of modules whose files (including the project files they import)"
+                     " and pytest arguments haven't changed since they last ran")
+    g.addoption("--cleanslate-cache-clear", action="store_true",
+                help="Discard the results cached by --cleanslate-cache before running")
+    g.addoption("--cleanslate-index", action="store_true",
+                help="Keep the index of collected items (saved by --collect-only) up to date, and use it to skip"
+                     " modules none of whose items are selected, without forking them")
 
 
 def pytest_configure(config: pytest.Config) -> None:
+    config.addinivalue_line("markers", "cleanslate_fork: always run this module in a forked child,"
+                                       " even with --cleanslate-mode=restore")
     if config.getoption("--cleanslate"):
         config.pluginmanager.register(CleanSlatePlugin(), "cleanslate_plugin")
@@ -0,0 +1,148 @@
+import pytest
+import builtins
+import importlib
+import importlib.util
+import os
+import sys
+import sysconfig
+import time
+import typing as T
+from .restore import Snapshot
+
+
+CACHE_KEY = "cleanslate/preload"
+
+
+def _site_dirs() -> T.List[str]:
+    paths = sysconfig.get_paths()
+    return sorted({os.path.join(os.path.realpath(paths[key]), '') for key in ('purelib', 'platlib')})
+
+
+def _is_third_party(path: T.Optional[str], site_dirs: T.List[str]) -> bool:
+    return path is not None and any(os.path.realpath(path).startswith(d) for d in site_dirs)
+
+
+class ImportTracker:
+    """Observes, in a module's forked child, the third-party packages that the module's
+       collection imports: how long each took (including what it imported in turn), and
+       how importing it changed the interpreter's global state, which makes it unsafe
+       to preload."""
+
+    def __init__(self):
+        self._modules = set(sys.modules)
+        self._site_dirs = _site_dirs()
+        self._imports: T.Dict[str, dict] = {}
+        self._depth = 0
+        self._import = builtins.__import__
+        builtins.__import__ = self._tracking_import
+
+
+    def _tracking_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        top = name.partition('.')[0]
+        if level or self._depth or not top or top in sys.modules or top in self._imports:
+            return self._import(name, globals, locals, fromlist, level)
+
+        try:
+            spec = importlib.util.find_spec(top)
+        except (ImportError, ValueError):
+            spec = None
+        if spec is None or not _is_third_party(spec.origin or next(iter(spec.submodule_search_locations or ()), None),
+                                               self._site_dirs):
+            return self._import(name, globals, locals, fromlist, level)
+
+        snapshot = Snapshot()
+        self._depth += 1
+        start = time.perf_counter()
+        try:
+            return self._import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.perf_counter() - start
+            self._depth -= 1
+            if top in sys.modules:
+                self._imports[top] = {'time': elapsed, 'changes': snapshot.changes()}
+
+
+    def stop(self) -> T.Dict[str, dict]:
+        """Stops observing, returning the third-party packages newly imported, with how long
+           each took and how it changed the global state ('time' is None for those imported
+           by other packages, as it's included in theirs)."""
+        builtins.__import__ = self._import
+
+        imports = dict(self._imports)
+        for name in {n.partition('.')[0] for n in sys.modules if n not in self._modules}:
+            if (name not in imports and (module := sys.modules.get(name)) is not None
+                and _is_third_party(getattr(module, '__file__', None), self._site_dirs)):
+                imports[name] = {'time': None, 'changes': []}
+
+        return imports
+
+
+class Preloads:
+    """Recommends, based on the packages that modules' forked children import, the third-party
+       packages worth importing before forking, so that the children share them rather than
+       each importing them: those imported by more than one module, most imported first.
+       Packages that changed the global state as they were imported aren't recommended."""
+
+    def __init__(self, config: pytest.Config):
+        self._cache = getattr(config, "cache", None)
+        previous = self._cache.get(CACHE_KEY, {}) if self._cache else {}
+        self._previous: T.Dict[str, dict] = previous.get('packages', {})
+        self._unsafe: T.Dict[str, T.List[str]] = previous.get('unsafe', {})
+        self._packages: T.Dict[str, dict] = {}
+        self.modules = 0
+        self.preloaded: T.List[str] = []
+        self.failed: T.Dict[str, str] = {}
+
+
+    def preload(self) -> None:
+        """Imports the packages recommended by an earlier session."""
+        for name in self._recommend(self._previous):
+            if name in sys.modules:
+                continue
+            try:
+                importlib.import_module(name)
+                self.preloaded.append(name)
+            except Exception as e:
+                self.failed[name] = f"{type(e).__name__}: {e}"
+
+
+    def record(self, imports: T.Dict[str, dict]) -> None:
+        """Records the packages a module's child imported."""
+        self.modules += 1
+        for name, observed in imports.items():
+            stats = self._packages.setdefault(name, {'modules': 0, 'time': 0, 'timed': 0})
+            stats['modules'] += 1
+            if observed['time'] is not None:
+                stats['time'] += observed['time']
+                stats['timed'] += 1
+            if observed['changes']:
+                self._unsafe[name] = observed['changes']
+
+
+    def _recommend(self, packages: T.Dict[str, dict]) -> T.List[str]:
+        candidates = [name for name, stats in packages.items()
+                      if stats['modules'] > 1 and stats['timed'] and name not in self._unsafe]
+        return sorted(candidates, key=lambda name: (-packages[name]['modules'],
+                                                    -packages[name]['time'] / packages[name]['timed']))
+
+
+    def _all_packages(self) -> T.Dict[str, dict]:
+        # packages preloaded aren't imported by the children, so we go by what we saw earlier
+        return {**{name: self._previous[name] for name in self.preloaded}, **self._packages}
+
+
+    def recommendations(self) -> T.List[T.Tuple[str, dict]]:
+        """Returns the recommended packages, most worth preloading first, with their statistics:
+           how many modules imported them and how long their import took (in total, for 'timed' of them)."""
+        packages = self._all_packages()
+        return [(name, packages[name]) for name in self._recommend(packages)]
+
+
+    def unsafe(self) -> T.Dict[str, T.List[str]]:
+        """Returns the packages seen to change the global state, with what they changed."""
+        return {name: changes for name, changes in self._unsafe.items() if name in self._packages}
+
+
+    def save(self) -> None:
+        if self._cache and (self._packages or self.preloaded):
+            self._cache.set(CACHE_KEY, {'packages': self._all_packages(), 'unsafe': self._unsafe})
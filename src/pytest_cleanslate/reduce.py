@@ -6,12 +6,31 @@ import sys
 from .__version__ import __version__
 import tqdm
 import math
+import bisect
+import itertools
+import os
+import signal
+import time
+import threading
+import contextlib
+import uuid
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
 
 
 PYTEST_ARGS = ('-qq', '-p', 'pytest_cleanslate.reduce')
 MODULE_LIST_ARG = '--module-list-from'
 TEST_LIST_ARG = '--test-list-from'
 RESULTS_ARG = '--results-to'
+SCAN_ARG = '--scan-for'
+ORDER_ARG = '--test-order-from'
+SCAN_JOBS_ARG = '--scan-jobs'
+
+
+class _FailingModule(pytest.File):
+    """Stands for the failing module in a scan, as it only gets collected in the checkpoints."""
+    def collect(self):
+        self.config._cleanslate_reduce_plugin._past_failing = True
+        return []
 
 
 class ReducePlugin:
@@ -28,9 +47,31 @@ class ReducePlugin:
         else:
             self._tests = None
 
+        if (order_file := config.getoption(ORDER_ARG)):
+            with order_file.open('r') as f:
+                self._order = {line.strip(): i for i, line in enumerate(f)}
+        else:
+            self._order = None
+
         self._results_file = config.getoption(RESULTS_ARG)
         self._collect = []
         self._run = []
+        self._durations = {}
+        self._collect_start = {}
+
+        self._scan_for = config.getoption(SCAN_ARG)
+        self._scan_jobs = config.getoption(SCAN_JOBS_ARG) or os.cpu_count()
+        self._session = None
+        self._failing_item = None
+        self._past_failing = False
+        self._in_checkpoint = False
+        self._checkpoints: T.List[T.Tuple[str, int]] = []   # candidate, pid
+        self._checkpoint_failed: T.Dict[str, T.Optional[bool]] = {}
+
+
+    @pytest.hookimpl
+    def pytest_sessionstart(self, session: pytest.Session) -> None:
+        self._session = session
 
 
     @pytest.hookimpl
@@ -39,15 +80,35 @@ class ReducePlugin:
             return collection_path.resolve() not in self._modules
 
 
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_pycollect_makemodule(self, module_path: Path, parent) -> T.Optional[pytest.Collector]:
+        if (self._scan_for and _is_module(self._scan_for) and not self._in_checkpoint
+            and module_path == parent.config.rootpath / self._scan_for):
+            return _FailingModule.from_parent(parent, path=module_path)
+
+
+    @pytest.hookimpl
+    def pytest_collectstart(self, collector: pytest.Collector) -> None:
+        if self._results_file and collector.nodeid.endswith('.py'):
+            self._collect_start[collector.nodeid] = time.perf_counter()
+
+
     @pytest.hookimpl
     def pytest_collectreport(self, report: pytest.CollectReport) -> None:
         if self._results_file and report.nodeid.endswith('.py'):
+            if (start := self._collect_start.pop(report.nodeid, None)) is not None:
+                self._durations[report.nodeid] = time.perf_counter() - start
+
             self._collect.append({
                 'id': report.nodeid,
                 'outcome': report.outcome,
                 'result': [n.nodeid for n in report.result]
             })
 
+        if (self._scan_for and not self._in_checkpoint and not self._past_failing
+            and report.nodeid.endswith('.py')):
+            self._checkpoint(report.nodeid)
+
 
     @pytest.hookimpl(tryfirst=True)
     def pytest_collection_modifyitems(self, items: T.List[pytest.Item], config: pytest.Config) -> T.Union[None, bool]:
@@ -56,7 +117,7 @@ class ReducePlugin:
             deselected = []
 
             for item in items:
-                if item.nodeid in self._tests:
+                if any(unit in self._tests for unit in _get_units(item.nodeid)):
                     selected.append(item)
                 else:
                     deselected.append(item)
@@ -65,9 +126,117 @@ class ReducePlugin:
                 config.hook.pytest_deselected(items=deselected)
                 items[:] = selected
 
+        if self._order is not None:
+            if (deselected := [item for item in items if item.nodeid not in self._order]):
+                config.hook.pytest_deselected(items=deselected)
+            items[:] = sorted((item for item in items if item.nodeid in self._order),
+                              key=lambda item: self._order[item.nodeid])
+
+        if self._scan_for and not self._in_checkpoint and not _is_module(self._scan_for):
+            # the candidates are the tests before the failing one, which only runs in the checkpoints
+            for i, item in enumerate(items):
+                if item.nodeid == self._scan_for:
+                    self._failing_item = item
+                    del items[i:]
+                    break
+
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_protocol(self, item: pytest.Item, nextitem: T.Optional[pytest.Item]):
+        yield
+        if self._scan_for and not self._in_checkpoint and self._failing_item:
+            self._checkpoint(item.nodeid)
+            if self._scan_polluter(wait=False) is not None:
+                item.session.shouldstop = "found polluter"
+
+
+    def _checkpoint(self, candidate: str) -> None:
+        """Forks a child that runs the failing test (or collects the failing module) in the
+           current state, i.e., after all candidates up to and including the given one."""
+        if self._scan_polluter(wait=False) is not None:
+            return  # already found
+
+        # wait for any one checkpoint to finish; os.wait() could reap the tests' own children
+        while True:
+            self._reap(self._checkpoints, wait=False)
+            if sum(failed is None for failed in self._checkpoint_failed.values()) < self._scan_jobs:
+                break
+            time.sleep(.01)
+
+        sys.stdout.flush()
+        sys.stderr.flush()
+        if (pid := os.fork()) == 0:
+            code = 2
+            try:
+                self._in_checkpoint = True
+                devnull = os.open(os.devnull, os.O_WRONLY)
+                os.dup2(devnull, 1)
+                os.dup2(devnull, 2)
+                code = 1 if self._run_failing() else 0
+            finally:
+                os._exit(code)
+
+        self._checkpoints.append((candidate, pid))
+        self._checkpoint_failed[candidate] = None
+
+
+    def _run_failing(self) -> bool:
+        """Runs the failing test (or collects the failing module), returning whether it failed."""
+        import _pytest.runner
+
+        session = self._session
+        if (item := self._failing_item) is None:
+            module, _, rest = self._scan_for.partition('::')
+            failures = session.testsfailed
+            items = session.perform_collect([str(session.config.rootpath / module) + _ + rest])
+            if _is_module(self._scan_for):
+                return session.testsfailed > failures
+
+            item = next(it for it in items if it.nodeid == self._scan_for)
+
+        session._setupstate.teardown_exact(item)
+        return any(rep.failed for rep in _pytest.runner.runtestprotocol(item, log=False, nextitem=None))
+
+
+    def _reap(self, checkpoints: T.List[T.Tuple[str, int]], *, wait: bool) -> None:
+        for candidate, pid in checkpoints:
+            if self._checkpoint_failed[candidate] is None:
+                pid, status = os.waitpid(pid, 0 if wait else os.WNOHANG)
+                if pid:
+                    # anything but a clean failure (such as a crash) is considered inconclusive
+                    self._checkpoint_failed[candidate] = (os.WIFEXITED(status) and os.WEXITSTATUS(status) == 1)
+
+
+    def _scan_polluter(self, *, wait: bool) -> T.Optional[str]:
+        """Returns the first candidate whose checkpoint failed, if known (i.e., once all
+           checkpoints before it are known to have passed)."""
+        self._reap(self._checkpoints, wait=False)
+        for candidate, pid in self._checkpoints:
+            if wait:
+                self._reap([(candidate, pid)], wait=True)
+            if (failed := self._checkpoint_failed[candidate]) is None:
+                return None
+            if failed:
+                return candidate
+
+        return None
+
+
+    def finish_scan(self) -> T.Optional[str]:
+        """Waits for the checkpoints needed to find the polluter, killing the rest."""
+        polluter = self._scan_polluter(wait=True)
+        for candidate, pid in self._checkpoints:
+            if self._checkpoint_failed[candidate] is None:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+        return polluter
+
 
     @pytest.hookimpl
     def pytest_runtest_logreport(self, report: pytest.TestReport) -> None:
+        if self._results_file:
+            self._durations[report.nodeid] = self._durations.get(report.nodeid, 0) + report.duration
+
         # to cut down on the log, we only save non-call run reports for failures
         if self._results_file and (report.outcome != 'passed' or report.when == 'call'):
             self._run.append({
@@ -81,7 +250,9 @@ class ReducePlugin:
             with self._results_file.open("w") as f:
                 json.dump({
                     'collect': self._collect,
-                    'run': self._run
+                    'run': self._run,
+                    'durations': self._durations,
+                    **({'scan': {'polluter': self.finish_scan()}} if self._scan_for else {})
                 }, f)
 
 
@@ -90,12 +261,18 @@ def pytest_addoption(parser: pytest.Parser, pluginmanager: pytest.PytestPluginMa
     parser.addoption(MODULE_LIST_ARG, type=Path, help="Only collect modules in the given file")
     parser.addoption(TEST_LIST_ARG, type=Path, help="Only run tests whose node IDs are in the given file")
     parser.addoption(RESULTS_ARG, type=Path, help="Write test collection/run results to the given file")
+    parser.addoption(ORDER_ARG, type=Path,
+                     help="Only run tests whose node IDs are in the given file, in the order given")
+    parser.addoption(SCAN_ARG, metavar="NODEID",
+                     help="Look for the first module or test after which the given (failing) one fails,"
+                          " running it in a forked checkpoint after each")
+    parser.addoption(SCAN_JOBS_ARG, type=int, help="Maximum number of checkpoints to run concurrently")
 
 
 @pytest.hookimpl
 def pytest_configure(config: pytest.Config) -> None:
     if config.getoption(MODULE_LIST_ARG) or config.getoption(TEST_LIST_ARG) or \
-       config.getoption(RESULTS_ARG):
+       config.getoption(RESULTS_ARG) or config.getoption(SCAN_ARG) or config.getoption(ORDER_ARG):
         config._cleanslate_reduce_plugin = ReducePlugin(config)
         config.pluginmanager.register(config._cleanslate_reduce_plugin)
 
@@ -115,7 +292,26 @@ class Results:
 
         self._outcomes = None
 
+    @classmethod
+    def from_data(cls, data: T.Optional[dict]) -> "Results":
+        """Returns results from their data, as saved in the results file (or None, if timed out)."""
+        results = cls.__new__(cls)
+        results._results = data
+        results._outcomes = None
+        return results
+
+    @classmethod
+    def timed_out(cls) -> "Results":
+        """Returns results for a run that was killed for taking too long."""
+        return cls.from_data(None)
+
+    def get_data(self) -> T.Optional[dict]:
+        return self._results
+
     def get_outcome(self, nodeid: str) -> str:
+        if self._results is None:
+            return 'timeout'
+
         if self._outcomes is None:
             self._outcomes = {r['id']: r['outcome'] for r in self._results['collect'] + self._results['run']}
 
@@ -133,6 +329,32 @@ class Results:
     def get_first_failed(self) -> T.Union[None, str]:
         return next(self.get_failed(), None)
 
+    def get_scan_polluter(self) -> T.Optional[str]:
+        """Returns the module or test found by --scan-for, if any."""
+        return (self._results or {}).get('scan', {}).get('polluter')
+
+    def get_duration(self, nodeid: str) -> float:
+        """Returns how long the module took to collect, or the test to run (in seconds)."""
+        return self._results.get('durations', {}).get(nodeid, 0)
+
+    def get_expected_duration(self, modules: T.List[str] = None, tests: T.List[str] = None) -> float:
+        """Returns how long a run with the given modules and tests (or units containing them,
+           as in --test-list-from) is expected to take, based on these results."""
+        module_durations = self.get_module_durations(tests)
+        return sum(module_durations.values()) if not modules \
+               else sum(module_durations.get(m, 0) for m in set(modules))
+
+    def get_module_durations(self, tests: T.List[str] = None) -> T.Dict[str, float]:
+        """Returns how long each module is expected to take in a run with the given tests,
+           as in get_expected_duration()."""
+        test_set = set(tests) if tests else None
+        durations: T.Dict[str, float] = {}
+        for nodeid, duration in self._results.get('durations', {}).items():
+            if test_set is None or _is_module(nodeid) or any(unit in test_set for unit in _get_units(nodeid)):
+                module = get_module(nodeid)
+                durations[module] = durations.get(module, 0) + duration
+        return durations
+
 
 def get_module(testid: str) -> str:
     return testid.split('::')[0]
@@ -147,8 +369,42 @@ def get_function(testid: str) -> str:
         return testid.split('::')[1].split('[')[0]
 
 
+def _strip_parameters(testid: str) -> str:
+    # parameter IDs may contain '::', so these must go first
+    if testid.endswith(']') and '[' in testid:
+        return testid[:testid.index('[')]
+    return testid
+
+
+def _get_class_unit(testid: str) -> str:
+    parts = _strip_parameters(testid).split('::')
+    return '::'.join(parts[:2])
+
+
+# Levels used to reduce tests hierarchically, from coarsest to finest; each maps a test ID
+# to the node ID of the unit that contains it at that level.  For module-level functions,
+# the "class" unit is the function itself.
+_TEST_LEVELS = (_get_class_unit, _strip_parameters, lambda testid: testid)
+
+
+def _get_units(testid: str) -> T.Iterator[str]:
+    """Yields the node IDs of the (module excluded) units that contain the given test."""
+    return iter(dict.fromkeys(get_unit(testid) for get_unit in _TEST_LEVELS))
+
+
+def _get_unit(testid: str, level: int, failing: str) -> str:
+    """Returns the unit containing `testid` at the given level, descending to finer
+       levels where that unit would also contain the failing test."""
+    for get_unit in _TEST_LEVELS[level:]:
+        if (unit := get_unit(testid)) != get_unit(failing):
+            return unit
+
+    assert False, "testid must differ from failing"
+
+
 def run_pytest(tests_path: Path, pytest_args=(), *,
-               modules: T.List[Path] = None, tests: T.List[str] = None, trace: bool = False) -> dict:
+               modules: T.List[Path] = None, tests: T.List[str] = None, order: T.List[str] = None,
+               trace: bool = False, timeout: float = None) -> Results:
     import tempfile
     import subprocess
 
@@ -166,43 +422,389 @@ def run_pytest(tests_path: Path, pytest_args=(), *,
             testlist = tmpdir / "tests.txt"
             testlist.write_text('\n'.join(tests))
 
+        if order:
+            orderlist = tmpdir / "order.txt"
+            orderlist.write_text('\n'.join(order))
+
         command = [
             sys.executable, '-m', 'pytest', *PYTEST_ARGS, *pytest_args,
             RESULTS_ARG, results,
             *((MODULE_LIST_ARG, modulelist) if modules else ()),
             *((TEST_LIST_ARG, testlist) if tests else ()),
+            *((ORDER_ARG, orderlist) if order else ()),
             tests_path
         ]
 
         if trace:
             print(f"Running {command}", flush=True)
 
-        p = subprocess.run(command,
-                           check=False, **({} if trace else {'stdout': subprocess.DEVNULL}))
+        # pytest may fork (such as with --cleanslate), so we run it in its own process group,
+        # so that we can kill all of it if it takes too long
+        p = subprocess.Popen(command, start_new_session=True,
+                             **({} if trace else {'stdout': subprocess.DEVNULL}))
+        try:
+            p.wait(timeout)
+        except subprocess.TimeoutExpired:
+            if trace:
+                print(f"Timed out after {timeout:.1f}s", flush=True)
+            return Results.timed_out()
+        finally:
+            if p.returncode is None:
+                os.killpg(p.pid, signal.SIGKILL)
+                p.wait()
+
         if p.returncode not in (pytest.ExitCode.OK, pytest.ExitCode.TESTS_FAILED,
                                 pytest.ExitCode.INTERRUPTED, pytest.ExitCode.NO_TESTS_COLLECTED):
-            p.check_returncode()
+            raise subprocess.CalledProcessError(p.returncode, command)
 
         return Results(results)
 
 
-def _bisect_items(items: T.List[str], failing: str, fails: T.Callable[[T.List[str], str], bool],
-                  *, bar: "tqdm") -> T.List[str]:
+def _write_json(path: Path, data: T.Any) -> None:
+    """Writes the file atomically, so that readers polling for it never see it partially written."""
+    tmp = path.with_suffix('.tmp')
+    tmp.write_text(json.dumps(data))
+    os.replace(tmp, path)
+
+
+class QueueExecutor(Executor):
+    """Executes run_pytest() trials by handing them out, through a queue directory (which may be
+       shared among hosts), to worker processes; see work().  Workers must run from the same
+       checkout (and directory within it) as the reduction.  A worker holding a trial renews its
+       claim periodically; trials whose claim goes `lease` seconds without renewal (say, because
+       the worker died) are handed out again."""
+
+    def __init__(self, queue_dir: Path, *, poll_interval: float = .1, lease: float = 60):
+        self._dir = queue_dir
+        for subdir in ('pending', 'claimed', 'done'):
+            (queue_dir / subdir).mkdir(parents=True, exist_ok=True)
+
+        self._poll_interval = poll_interval
+        self._lease = lease
+        self._futures: T.Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._shutdown = threading.Event()
+        self._poller = threading.Thread(target=self._poll, daemon=True)
+        self._poller.start()
+
+
+    def submit(self, fn: T.Callable, tests_path: Path, pytest_args=(), **kwargs) -> Future:
+        if fn is not run_pytest:
+            raise ValueError("QueueExecutor can only execute run_pytest")
+        if self._shutdown.is_set():
+            raise RuntimeError("cannot submit after shutdown")
+
+        # names sort in submission order, so that workers take trials first come, first served
+        trial_id = f"{time.time_ns():020d}-{uuid.uuid4().hex}"
+        future = Future()
+        with self._lock:
+            self._futures[trial_id] = future
+
+        _write_json(self._dir / "pending" / f"{trial_id}.json",
+                    {'tests_path': str(tests_path), 'pytest_args': [str(a) for a in pytest_args],
+                     'lease': self._lease, **kwargs})
+        return future
+
+
+    def _poll(self) -> None:
+        while not self._shutdown.is_set():
+            for path in sorted((self._dir / "done").glob("*.json")):
+                with self._lock:
+                    future = self._futures.pop(path.stem, None)
+                if future is None:
+                    continue    # another reduction's
+
+                outcome = json.loads(path.read_text())
+                path.unlink()
+                # if its claim lapsed, the trial may have been handed out again
+                (self._dir / "pending" / path.name).unlink(missing_ok=True)
+                if future.set_running_or_notify_cancel():
+                    if 'error' in outcome:
+                        future.set_exception(RuntimeError(f"trial failed on worker: {outcome['error']}"))
+                    else:
+                        future.set_result(Results.from_data(outcome['results']))
+
+            self._requeue_lapsed()
+            time.sleep(self._poll_interval)
+
+
+    def _requeue_lapsed(self) -> None:
+        with self._lock:
+            trial_ids = list(self._futures)
+
+        for trial_id in trial_ids:
+            claimed = self._dir / "claimed" / f"{trial_id}.json"
+            try:
+                if time.time() - claimed.stat().st_mtime > self._lease:
+                    os.rename(claimed, self._dir / "pending" / claimed.name)
+            except FileNotFoundError:
+                pass
+
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False) -> None:
+        # trials still outstanding may never complete (for example, if there are no workers),
+        # so rather than wait for them, we withdraw them.
+        self._shutdown.set()
+        with self._lock:
+            futures, self._futures = self._futures, {}
+
+        for trial_id, future in futures.items():
+            for subdir in ('pending', 'claimed'):
+                (self._dir / subdir / f"{trial_id}.json").unlink(missing_ok=True)
+            future.cancel()
+
+        if wait:
+            self._poller.join()
+
+
+def _claim_trial(queue_dir: Path) -> T.Optional[T.Tuple[Path, dict]]:
+    for path in sorted((queue_dir / "pending").glob("*.json")):
+        claimed = queue_dir / "claimed" / path.name
+        try:
+            os.rename(path, claimed)   # atomic, so only one worker gets it
+            os.utime(claimed)          # starts the claim's lease
+            return claimed, json.loads(claimed.read_text())
+        except FileNotFoundError:
+            continue
+
+    return None
+
+
+def work(queue_dir: Path, *, jobs: int = 1, poll_interval: float = .1) -> None:
+    """Runs the trials handed out through a QueueExecutor's queue directory, `jobs` at a time,
+       until interrupted."""
+    for subdir in ('pending', 'claimed', 'done'):
+        (queue_dir / subdir).mkdir(parents=True, exist_ok=True)
+
+    def renew(path: Path, lease: float, done: threading.Event) -> None:
+        while not done.wait(lease / 4):
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                return
+
+    def worker():
+        while True:
+            if (claimed := _claim_trial(queue_dir)) is None:
+                time.sleep(poll_interval)
+                continue
+
+            path, spec = claimed
+            done = threading.Event()
+            threading.Thread(target=renew, args=(path, spec.pop('lease'), done), daemon=True).start()
+            try:
+                results = run_pytest(Path(spec.pop('tests_path')), spec.pop('pytest_args'), **spec)
+                outcome = {'results': results.get_data()}
+            except Exception as e:
+                outcome = {'error': repr(e)}
+            finally:
+                done.set()
+
+            if not path.exists():
+                continue    # the trial was withdrawn, or our claim lapsed and it was handed out again
+
+            _write_json(queue_dir / "done" / path.name, outcome)
+            path.unlink(missing_ok=True)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(jobs)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+class TrialCache:
+    """Memoizes trial results, so that reductions (even concurrent ones) sharing it don't
+       repeat identical pytest runs.  Runs that time out, raise or are cancelled aren't remembered."""
+
+    def __init__(self):
+        self._futures: T.Dict[tuple, Future] = {}
+        self._lock = threading.Lock()
+
+
+    def submit(self, key: tuple, submit: T.Callable[[], Future]) -> Future:
+        with self._lock:
+            if (new := (future := self._futures.get(key)) is None):
+                future = self._futures[key] = submit()
+
+        if new:
+            # outside the lock, as the callback runs right away if the future is already done
+            future.add_done_callback(lambda f: self._check_done(key, f))
+
+        return future
+
+
+    def _check_done(self, key: tuple, future: Future) -> None:
+        if future.cancelled() or future.exception() is not None or future.result().get_data() is None:
+            with self._lock:
+                if self._futures.get(key) is future:
+                    del self._futures[key]
+
+
+class FlakyTrials:
+    """Decides whether (possibly flaky) trials reproduce the failure, repeating them only while
+       the outcome is ambiguous.  Uses Wald's sequential probability ratio test, where H1 is
+       that the trial fails with the probability estimated from the baseline and H0 that it
+       only fails spuriously; repeats are executed concurrently."""
+
+    P_SPURIOUS = .01
+
+    def __init__(self, p_fail: float, *, confidence: float = .95, max_runs: int = 10, jobs: int = None):
+        # H1 must be distinguishable from H0, or the test can't decide (or decides backwards)
+        self.p_fail = p_fail = min(max(p_fail, 2 * self.P_SPURIOUS), 1 - self.P_SPURIOUS)
+        self._fail_llr = math.log(p_fail / self.P_SPURIOUS)
+        self._pass_llr = math.log((1 - p_fail) / (1 - self.P_SPURIOUS))
+        self._threshold = math.log(confidence / (1 - confidence))
+        self._max_runs = max_runs
+        self._jobs = jobs or os.cpu_count()
+        self.decisions: T.List[float] = []
+
+
+    @classmethod
+    def from_baseline(cls, run: T.Callable[[int], T.List[T.Optional[bool]]], *,
+                      max_runs: int = 10, **kwargs) -> "FlakyTrials":
+        """Estimates the failure probability by repeating the baseline trial; the initial
+           (failed) run is counted as well."""
+        failures = 1 + sum(bool(failed) for failed in run(max_runs))
+        return cls(failures / (1 + max_runs), max_runs=max_runs, **kwargs)
+
+
+    def _llr(self, failed: T.Optional[bool]) -> float:
+        # inconclusive trials (None) count as runs, but don't change the ratio
+        return 0 if failed is None else self._fail_llr if failed else self._pass_llr
+
+
+    def fails(self, run: T.Callable[[int], T.List[T.Optional[bool]]]) -> bool:
+        """Decides whether a trial fails; `run(n)` runs it n times (concurrently) and
+           returns whether each run failed."""
+        llr = sum(map(self._llr, run(1)))
+        runs = 1
+        while abs(llr) < self._threshold and runs < self._max_runs:
+            # run (at most) as many repeats as could still be needed to decide
+            if llr >= 0:
+                needed = math.ceil((self._threshold - llr) / self._fail_llr)
+            else:
+                needed = math.ceil((self._threshold + llr) / -self._pass_llr)
+
+            count = max(1, min(needed, self._jobs, self._max_runs - runs))
+            llr += sum(map(self._llr, run(count)))
+            runs += count
+
+        # posterior probability that the decision is right, assuming equal priors
+        self.decisions.append(1 / (1 + math.exp(-abs(llr))))
+        return llr > 0
+
+
+    def confidence(self, since: int = 0, until: int = None) -> float:
+        """Returns the probability that all decisions (since the given one, and up to but
+           excluding `until`) were right."""
+        return math.prod(self.decisions[since:until])
+
+
+class Trials:
+    """Runs a reduction's pytest trials through an executor, checking whether they reproduce
+       the failure, and reports its progress as events."""
+
+    def __init__(self, tests_path: Path, *, pytest_args: T.List[str] = (), trace: bool = False,
+                 executor: Executor, cache: TrialCache = None,
+                 on_event: T.Callable[[dict], None] = lambda event: None):
+        self.tests_path = tests_path
+        self.pytest_args = tuple(pytest_args)
+        self.trace = trace
+        self.emit = on_event
+        self._executor = executor
+        self._cache = cache
+        self.failing_id = None
+        self.timeout: T.Callable[..., T.Optional[float]] = lambda **_: None
+        self.timeout_means = 'inconclusive'
+        self.flaky: FlakyTrials = None
+
+
+    def submit(self, pytest_args: T.List[str] = (), *, modules: T.List[str] = None,
+               tests: T.List[str] = None, memoize: bool = True) -> Future:
+        """Submits a pytest run to the executor, returning a future for its Results."""
+        args = (*self.pytest_args, *pytest_args)
+        kwargs = {'modules': modules, 'tests': tests, 'trace': self.trace,
+                  'timeout': self.timeout(modules=modules, tests=tests)}
+
+        def submit():
+            return self._executor.submit(run_pytest, self.tests_path, args, **kwargs)
+
+        if self._cache and memoize:
+            key = (os.getcwd(), str(self.tests_path), args, tuple(modules or ()), tuple(tests or ()))
+            return self._cache.submit(key, submit)
+
+        return submit()
+
+
+    def run(self, pytest_args: T.List[str] = (), **kwargs) -> Results:
+        return self.submit(pytest_args, **kwargs).result()
+
+
+    def failed(self, results: Results) -> T.Optional[bool]:
+        if (outcome := results.get_outcome(self.failing_id)) == 'timeout':
+            return True if self.timeout_means == 'fails' else None
+        return outcome == 'failed'
+
+
+    def runner(self, check: T.Callable[[Results], T.Optional[bool]], pytest_args: T.List[str] = (), *,
+               memoize: bool = None, **selection) -> T.Callable[[int], T.List[T.Optional[bool]]]:
+        """Returns a function that runs a trial n times concurrently, returning each check."""
+        if memoize is None:
+            memoize = self.flaky is None  # repeating is pointless if memoized
+
+        def run(count: int) -> T.List[T.Optional[bool]]:
+            futures = [self.submit(pytest_args, memoize=memoize, **selection) for _ in range(count)]
+            return [check(f.result()) for f in futures]
+
+        return run
+
+
+    def fails(self, *, modules: T.List[str] = None, tests: T.List[str] = None) -> T.Optional[bool]:
+        run = self.runner(self.failed, ('--continue-on-collection-errors',), modules=modules, tests=tests)
+        return self.flaky.fails(run) if self.flaky else run(1)[0]
+
+
+def _split_point(costs: T.List[float]) -> int:
+    """Returns where to split items with the given costs so that both halves are expected to
+       take about as long to run; without (nonzero) costs, that's the middle."""
+    sums = list(itertools.accumulate(costs))
+    if not sums or not sums[-1]:
+        return len(costs) // 2
+
+    # the split is just before or after the first prefix reaching half the total
+    half = sums[-1] / 2
+    i = bisect.bisect_left(sums, half, 0, len(sums) - 1)
+    if i == len(sums) - 1 or (i > 0 and half - sums[i-1] <= sums[i] - half):
+        i -= 1
+
+    return i + 1
+
+
+def _bisect_items(items: T.List[str], failing: str, fails: T.Callable[[T.List[str]], T.Optional[bool]],
+                  *, progress: T.Callable[[int], None],
+                  cost: T.Optional[T.Callable[[str], float]] = None) -> T.List[str]:
+    # an inconclusive trial (None) is treated conservatively, like one that doesn't fail:
+    # items are only eliminated based on trials that do fail.
+    # `cost` estimates how long an item takes to run; items are then split by expected runtime
+    # rather than by count, and the cheaper half is tried first, as the other may not need to be.
     assert failing not in items
 
     while len(items) > 1:
-        middle = len(items) // 2
+        costs = [cost(item) for item in items] if cost else [0] * len(items)
+        middle = _split_point(costs)
+        halves = [items[:middle], items[middle:]]
+        if sum(costs[middle:]) < sum(costs[:middle]):
+            halves.reverse()
 
-        bar.refresh() # for when using --trace
-        bar.set_postfix({"remaining": len(items)})
-        bar.update()
+        progress(len(items))
 
-        if fails(items[:middle]+[failing]):
-            items = items[:middle]
+        if fails(halves[0]+[failing]):
+            items = halves[0]
             continue
 
-        if fails(items[middle:]+[failing]):
-            items = items[middle:]
+        if fails(halves[1]+[failing]):
+            items = halves[1]
             continue
 
         # TODO could do the rest of delta debugging here
@@ -211,77 +813,227 @@ def _bisect_items(items: T.List[str], failing: str, fails: T.Callable[[T.List[st
     if len(items) == 1 and fails([failing]):
         items = []
 
-    bar.refresh() # for when using --trace
-    bar.set_postfix({"remaining": len(items)})
-    bar.update()
+    progress(len(items))
 
     return items
 
 
-def _reduce_tests(tests_path: Path, tests: T.List[str], failing_test: str, modules: T.List[str],
-                  *, trace: bool = False, pytest_args: T.List[str] = ()) -> T.List[str]:
+def _stage_progress(trials: Trials, stage: str) -> T.Callable[[int], None]:
+    return lambda remaining: trials.emit({'event': 'step', 'stage': stage, 'remaining': remaining})
+
+
+def _reduce_tests(trials: Trials, results: Results, tests: T.List[str], modules: T.List[str]) -> T.List[str]:
+    failing_test = trials.failing_id
+
     def fails(test_set: T.List[str]):
-        trial = run_pytest(tests_path, (*pytest_args, '--continue-on-collection-errors'),
-                           tests=test_set, modules=modules, trace=trace)
-        return trial.get_outcome(failing_test) == 'failed'
+        return trials.fails(tests=test_set, modules=modules)
 
     module_set = {*modules}
     tests = [t for t in tests if t != failing_test and get_module(t) in module_set]
     if not tests:
         return tests
 
-    steps=math.ceil(math.log(len(tests), 2))
-    with tqdm.tqdm(desc="Trying to reduce tests.....", total=steps) as bar:
-        return _bisect_items(tests, failing_test, fails, bar=bar)
+    # Reduce classes first, then functions, then parametrized instances, so that
+    # (deeply) parametrized tests don't each cost their own bisection steps.
+    prev_units = None
+    for level in range(len(_TEST_LEVELS)):
+        units = list(dict.fromkeys(_get_unit(t, level, failing_test) for t in tests))
+        if units == prev_units:
+            continue
+
+        unit_costs: T.Dict[str, float] = {}
+        for t in tests:
+            unit = _get_unit(t, level, failing_test)
+            unit_costs[unit] = unit_costs.get(unit, 0) + results.get_duration(t)
+
+        trials.emit({'event': 'stage', 'stage': 'tests', 'steps': math.ceil(math.log(len(units), 2)) + 1})
+        prev_units = _bisect_items(units, failing_test, fails, progress=_stage_progress(trials, 'tests'),
+                                   cost=unit_costs.get)
 
+        reduced = set(prev_units)
+        tests = [t for t in tests if _get_unit(t, level, failing_test) in reduced]
+        if not tests:
+            break
 
-def _reduce_modules(tests_path: Path, tests: T.List[str], failing_id: str,
-                    modules: T.List[str], failing_module: str,
-                    *, trace: bool = False, pytest_args: T.List[str] = ()) -> T.List[str]:
+    trials.emit({'event': 'stage_end', 'stage': 'tests', 'remaining': len(tests)})
+    return tests
 
+
+def _reduce_modules(trials: Trials, results: Results, tests: T.List[str], modules: T.List[str],
+                    failing_module: str) -> T.List[str]:
     def fails(module_set: T.List[str]):
-        trial = run_pytest(tests_path, (*pytest_args, '--continue-on-collection-errors',),
-                           tests=tests, modules=module_set, trace=trace)
-        return trial.get_outcome(failing_id) == 'failed'
+        return trials.fails(tests=tests, modules=module_set)
 
     modules = [m for m in modules if m != failing_module]
     if not modules:
         return modules
 
-    steps = math.ceil(math.log(len(modules), 2))
-    with tqdm.tqdm(desc="Trying to reduce modules...", total=steps) as bar:
-        return _bisect_items(modules, failing_module, fails, bar=bar)
+    module_costs = results.get_module_durations(tests)
+
+    trials.emit({'event': 'stage', 'stage': 'modules', 'steps': math.ceil(math.log(len(modules), 2))})
+    modules = _bisect_items(modules, failing_module, fails, progress=_stage_progress(trials, 'modules'),
+                            cost=lambda m: module_costs.get(m, 0))
+    trials.emit({'event': 'stage_end', 'stage': 'modules', 'remaining': len(modules)})
+    return modules
+
+
+def _scan(trials: Trials, results: Results, failed_module: str, *,
+          jobs: T.Optional[int]) -> T.Optional[T.Tuple[T.List[str], T.List[str]]]:
+    """Looks for the polluter in a single run, which forks a checkpoint running the failing test
+       after each module collected and each test run, reusing the work done before it.
+       Returns the modules and tests found, if they're enough to reproduce the failure."""
+    failing_id = trials.failing_id
+    trials.emit({'event': 'scanning', 'message': "Scanning for the polluter..."})
+    scan = trials.run((SCAN_ARG, failing_id, *((SCAN_JOBS_ARG, str(jobs)) if jobs else ())),
+                      modules=results.get_modules(), tests=results.get_tests())
+
+    if (polluter := scan.get_scan_polluter()) is None:
+        trials.emit({'event': 'scanned', 'polluter': None,
+                     'message': "The scan didn't find a polluter; bisecting instead..."})
+        return None
+
+    modules = [m for m in (get_module(polluter),) if m != failed_module]
+    tests = [] if _is_module(polluter) else [polluter]
+    if not trials.fails(modules=[*modules, failed_module],
+                        tests=results.get_tests() if _is_module(failing_id) else [*tests, failing_id]):
+        trials.emit({'event': 'scanned', 'polluter': polluter,
+                     'message': f"\"{polluter}\" doesn't cause the failure by itself; bisecting instead..."})
+        return None
+
+    trials.emit({'event': 'scanned', 'polluter': polluter, 'message': f"Found \"{polluter}\"."})
+    return modules, tests
+
+
+def _known_polluters(trials: Trials, results: Results, failed_module: str,
+                     dependencies: dict) -> T.Optional[T.Tuple[T.List[str], T.List[str]]]:
+    """Tries the failing test's polluters known from the dependency map, returning the
+       modules and tests of the first that reproduces the failure, if any."""
+    failing_id = trials.failing_id
+    ran = set(results.get_tests())
+    for dep in dependencies.get('dependencies', ()):
+        if dep['victim'] != failing_id or dep['kind'] != 'polluter' or not ran.issuperset(dep['tests']):
+            continue
+
+        modules = [m for m in dict.fromkeys(map(get_module, dep['tests'])) if m != failed_module]
+        if trials.fails(modules=[*modules, failed_module], tests=[*dep['tests'], failing_id]):
+            trials.emit({'event': 'known', 'polluters': dep['tests'],
+                         'message': f"Known polluter(s) {dep['tests']} reproduce the failure."})
+            return modules, dep['tests']
+
+    return None
+
+
+class _ConsoleProgress:
+    """Shows a reduction's progress events on the console."""
+
+    BAR_DESCRIPTIONS = {
+        'modules': "Trying to reduce modules...",
+        'tests':   "Trying to reduce tests.....",
+    }
+
+    def __init__(self, *, trace: bool = False):
+        self._trace = trace
+        self._bar = None
+
+    def __call__(self, event: dict) -> None:
+        kind = event['event']
+        if kind == 'stage':
+            if self._bar is None:
+                if self._trace: print()
+                self._bar = tqdm.tqdm(desc=self.BAR_DESCRIPTIONS[event['stage']], total=0)
+            self._bar.total += event['steps']
+            self._bar.refresh()
+        elif kind == 'step':
+            self._bar.refresh() # for when using --trace
+            self._bar.set_postfix({"remaining": event['remaining']})
+            self._bar.update()
+        elif kind == 'stage_end':
+            self._bar.close()
+            self._bar = None
+        elif 'message' in event:
+            if self._trace and kind in ('trying_alone', 'reduced'): print()
+            print(event['message'], flush=True)
 
 
 def reduce(*, tests_path: Path, results: Results = None, pytest_args: T.List[str] = (),
-           trace: bool = False, **args) -> dict:
+           trace: bool = False, flaky: bool = False, flaky_runs: int = 10, confidence: float = .95,
+           jobs: int = None, trial_timeout_factor: float = 10, trial_timeout_min: float = 60,
+           timeout_means: str = 'inconclusive', strategy: str = 'bisect',
+           dependencies: T.Union[Path, dict, None] = None, executor: Executor = None,
+           cache: TrialCache = None, on_event: T.Callable[[dict], None] = None, **args) -> dict:
+    """Looks for a reduced set of modules and tests that still lead to the first failure.
+       Trials are run through `executor` (by default, a thread pool with `jobs` workers),
+       optionally memoized in `cache`; progress events are passed to `on_event`
+       (by default, they're shown on the console).  Polluters already known from a
+       dependency map (see discover()) are tried first."""
+    if isinstance(dependencies, Path):
+        with dependencies.open("r") as f:
+            dependencies = json.load(f)
+
+    with (ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) if executor is None
+          else contextlib.nullcontext(executor)) as executor:
+        trials = Trials(tests_path, pytest_args=pytest_args, trace=trace, executor=executor, cache=cache,
+                        on_event=on_event or _ConsoleProgress(trace=trace))
+        return _reduce(trials, results, flaky=flaky, flaky_runs=flaky_runs, confidence=confidence, jobs=jobs,
+                       trial_timeout_factor=trial_timeout_factor, trial_timeout_min=trial_timeout_min,
+                       timeout_means=timeout_means, strategy=strategy, dependencies=dependencies)
+
+
+def _reduce(trials: Trials, results: T.Optional[Results], *, flaky: bool, flaky_runs: int, confidence: float,
+            jobs: T.Optional[int], trial_timeout_factor: float, trial_timeout_min: float,
+            timeout_means: str, strategy: str, dependencies: T.Optional[dict]) -> dict:
+    emit = trials.emit
+
     if not results:
-        print("Running tests...", flush=True)
-        results = run_pytest(tests_path, (*pytest_args, '-x'), trace=trace)
+        emit({'event': 'running', 'message': "Running tests..."})
+        results = trials.run(('-x',))
 
     failed_id = results.get_first_failed()
     if failed_id is None:
-        print("No tests failed!", flush=True)
+        emit({'event': 'no_failure', 'message': "No tests failed!"})
         return {
             'failed': failed_id,
             'error': 'No tests failed',
         }
 
+    trials.failing_id = failed_id
     failed_is_module = _is_module(failed_id)
     if failed_is_module:
-        if trace: print()
-        print(f"Module \"{failed_id}\"'s collection failed; trying it by itself...", flush=True)
+        emit({'event': 'trying_alone', 'failed': failed_id,
+              'message': f"Module \"{failed_id}\"'s collection failed; trying it by itself..."})
         failed_module = failed_id
         tests = None
     else:
-        if trace: print()
-        print(f"Test \"{failed_id}\" failed; trying it by itself...", flush=True)
+        emit({'event': 'trying_alone', 'failed': failed_id,
+              'message': f"Test \"{failed_id}\" failed; trying it by itself..."})
         failed_module = get_module(failed_id)
         tests = [failed_id]
 
-    solo = run_pytest(tests_path, pytest_args, modules=[failed_module], tests=tests, trace=trace)
-    if solo.get_outcome(failed_id) != 'passed':
-        print("That also fails by itself!", flush=True)
+    def timeout(*, modules: T.List[str] = None, tests: T.List[str] = None) -> T.Optional[float]:
+        # allow for some slack, as well as for tests that didn't run in the initial run (-x)
+        if trial_timeout_factor:
+            return max(trial_timeout_min,
+                       trial_timeout_factor * results.get_expected_duration(modules, tests))
+        return None
+
+    trials.timeout = timeout
+    trials.timeout_means = timeout_means
+
+    if flaky:
+        emit({'event': 'estimating', 'message': "Estimating the failure probability..."})
+        baseline = trials.runner(trials.failed, ('--continue-on-collection-errors',), memoize=False,
+                                 tests=results.get_tests(), modules=results.get_modules())
+        trials.flaky = FlakyTrials.from_baseline(baseline, max_runs=flaky_runs, confidence=confidence, jobs=jobs)
+        emit({'event': 'estimated', 'p_fail': trials.flaky.p_fail,
+              'message': f"It fails with probability ~{trials.flaky.p_fail:.2f}"})
+
+    def fails_by_itself(r: Results) -> T.Optional[bool]:
+        # a timeout is decided by --timeout-means, like in any other trial
+        return trials.failed(r) if r.get_outcome(failed_id) == 'timeout' else r.get_outcome(failed_id) != 'passed'
+
+    solo = trials.runner(fails_by_itself, modules=[failed_module], tests=tests)
+    if trials.flaky.fails(solo) if trials.flaky else solo(1)[0]:
+        emit({'event': 'fails_by_itself', 'message': "That also fails by itself!"})
         return {
             'failed': failed_id,
             'error': f'{"Module" if failed_is_module else "Test"} also fails by itself',
@@ -289,29 +1041,184 @@ def reduce(*, tests_path: Path, results: Results = None, pytest_args: T.List[str
 
     tests = results.get_tests()
 
-    if trace: print()
-    modules = _reduce_modules(tests_path, tests, failed_id, results.get_modules(), failed_module,
-                              trace=trace, pytest_args=pytest_args)
-
-    if not failed_is_module:
-        if trace: print()
-        tests = _reduce_tests(tests_path, tests, failed_id, [*modules, failed_module],
-                              trace=trace, pytest_args=pytest_args)
+    first_decision = len(trials.flaky.decisions) if trials.flaky else 0
+    found = None
+    if dependencies and not failed_is_module:
+        found = _known_polluters(trials, results, failed_module, dependencies)
+    if found is None and strategy == 'scan':
+        found = _scan(trials, results, failed_module, jobs=jobs)
+
+    if found is not None:
+        modules, found_tests = found
+        if not failed_is_module:
+            tests = found_tests
+        modules_decisions = len(trials.flaky.decisions) if trials.flaky else 0
+    else:
+        modules = _reduce_modules(trials, results, tests, results.get_modules(), failed_module)
+        modules_decisions = len(trials.flaky.decisions) if trials.flaky else 0
 
-        # TODO if tests != [], see if it's enough to disable just them
+        if not failed_is_module:
+            tests = _reduce_tests(trials, results, tests, [*modules, failed_module])
 
-    if trace: print()
-    print("Reduced failure set:")
-    print(f"    modules: {modules}")
-    print(f"    tests: {tests}")
-    print(flush=True)
+            # TODO if tests != [], see if it's enough to disable just them
 
-    return {
+    reduction = {
         'failed': failed_id,
         'modules': modules,
         'tests': tests,
     }
 
+    if trials.flaky:
+        # an item is only right if all decisions that led to it were right
+        modules_confidence = trials.flaky.confidence(first_decision, modules_decisions)
+        tests_confidence = modules_confidence * trials.flaky.confidence(modules_decisions)
+        reduction['confidence'] = {
+            **{m: round(modules_confidence, 4) for m in modules},
+            **{t: round(tests_confidence, 4) for t in (tests if not failed_is_module else ())}
+        }
+
+    emit({'event': 'reduced', 'reduction': reduction,
+          'message': f"Reduced failure set:\n    modules: {modules}\n    tests: {tests}\n"})
+    return reduction
+
+
+def _outcome_of(results: Results, nodeid: str) -> T.Optional[str]:
+    """Returns the test's outcome in the results, or None if unknown (such as if timed out)."""
+    if results.get_data() is None:
+        return None
+    try:
+        return results.get_outcome(nodeid)
+    except KeyError:
+        return None
+
+
+def discover(*, tests_path: Path, pytest_args: T.List[str] = (), runs: int = 4, seed: int = None,
+             trace: bool = False, jobs: int = None, trial_timeout_factor: float = 10,
+             trial_timeout_min: float = 60, executor: Executor = None, cache: TrialCache = None,
+             on_event: T.Callable[[dict], None] = None, **args) -> dict:
+    """Looks for order dependencies among the tests: tests ("victims") whose outcome depends on
+       which tests run before them, because those either make them fail ("polluters") or pass
+       ("setters").  The tests are run in `runs` orderings: the original, its reverse (so that
+       each pair of tests runs in both orders) and random shuffles.  For each test whose outcome
+       differs among them, the tests that preceded it are searched by adaptive group testing
+       (bisection), repeatedly, to find all it depends on.
+       Returns a dependency map, which can be passed to reduce() or to --cleanslate-dependencies."""
+    import random
+
+    with (ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) if executor is None
+          else contextlib.nullcontext(executor)) as executor:
+        emit = on_event or _ConsoleProgress(trace=trace)
+        cache = cache or TrialCache()
+        pytest_args = ('--continue-on-collection-errors', *pytest_args)
+        submitted = []
+
+        emit({'event': 'running', 'message': "Running tests..."})
+        baseline = executor.submit(run_pytest, tests_path, pytest_args, trace=trace).result()
+        tests = list(dict.fromkeys(baseline.get_tests()))
+
+        def run(order: T.List[str]) -> Future:
+            modules = list(dict.fromkeys(map(get_module, order)))
+
+            def submit():
+                submitted.append(order)
+                timeout = (max(trial_timeout_min,
+                               trial_timeout_factor * baseline.get_expected_duration(modules, order))
+                           if trial_timeout_factor else None)
+                return executor.submit(run_pytest, tests_path, pytest_args, modules=modules, order=order,
+                                       trace=trace, timeout=timeout)
+
+            return cache.submit((os.getcwd(), str(tests_path), pytest_args, 'order', tuple(order)), submit)
+
+        rng = random.Random(seed)
+        orderings = [tests, tests[::-1]]
+        while len(orderings) < runs:
+            orderings.append(rng.sample(tests, len(tests)))
+
+        emit({'event': 'orderings', 'count': len(orderings),
+              'message': f"Running {len(orderings)} orderings of {len(tests)} tests..."})
+        outcomes = [baseline] + [f.result() for f in [run(order) for order in orderings[1:]]]
+
+        victims = [t for t in tests
+                   if len({o for results in outcomes if (o := _outcome_of(results, t)) is not None}) > 1]
+        emit({'event': 'victims', 'victims': victims,
+              'message': f"{len(victims)} test(s) behave differently depending on the order."})
+
+        def find_dependencies(victim: str) -> T.List[dict]:
+            if (isolated := _outcome_of(run([victim]).result(), victim)) is None:
+                return []
+
+            def differs(order: T.List[str]) -> bool:
+                return _outcome_of(run(order).result(), victim) not in (None, isolated)
+
+            found = []
+            for order, results in zip(orderings, outcomes):
+                if _outcome_of(results, victim) in (None, isolated):
+                    continue
+
+                remaining = [t for t in order[:order.index(victim)] if not any(t in d['tests'] for d in found)]
+                while remaining and differs([*remaining, victim]):
+                    if not (group := _bisect_items(remaining, victim, differs, progress=lambda n: None,
+                                                 cost=baseline.get_duration)):
+                        break
+
+                    dependency = {'victim': victim, 'kind': 'polluter' if isolated == 'passed' else 'setter',
+                                  'tests': group}
+                    emit({'event': 'dependency', 'dependency': dependency,
+                          'message': f"{dependency['kind'].capitalize()}(s) of \"{victim}\": {group}"})
+                    found.append(dependency)
+                    remaining = [t for t in remaining if t not in group]
+
+            return found
+
+        # the searches mostly wait on their trials, which `executor` throttles anyway
+        with ThreadPoolExecutor(max_workers=max(1, min(len(victims), jobs or os.cpu_count()))) as victim_pool:
+            dependencies = [d for found in victim_pool.map(find_dependencies, victims) for d in found]
+
+    discovery = {
+        'orderings': len(orderings),
+        'trials': 1 + len(submitted),
+        'dependencies': dependencies,
+    }
+    emit({'event': 'discovered', 'discovery': discovery,
+          'message': f"Found {len(dependencies)} dependencies in {discovery['trials']} runs.\n"})
+    return discovery
+
+
+async def reduce_async(**kwargs) -> T.AsyncIterator[dict]:
+    """Performs a reduction like reduce() (taking the same arguments), but asynchronously,
+       yielding its progress events; the last event, 'done', includes the reduction.
+       To run several reductions at once without oversubscribing the machine, pass them
+       the same `executor` (and, to share trial results, the same `cache`)."""
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+    done = loop.create_future()
+
+    def on_event(event: dict) -> None:
+        loop.call_soon_threadsafe(events.put_nowait, event)
+
+    def run() -> None:
+        try:
+            reduction = reduce(**kwargs, on_event=on_event)
+        except BaseException as e:
+            loop.call_soon_threadsafe(done.set_exception, e)
+        else:
+            loop.call_soon_threadsafe(done.set_result, reduction)
+
+    # each reduction mostly waits on its trials, so it gets its own thread
+    threading.Thread(target=run, daemon=True).start()
+
+    while not done.done() or not events.empty():
+        get_event = asyncio.ensure_future(events.get())
+        await asyncio.wait({get_event, done}, return_when=asyncio.FIRST_COMPLETED)
+        if get_event.done():
+            yield get_event.result()
+        else:
+            get_event.cancel()
+
+    yield {'event': 'done', 'reduction': done.result()}
+
 
 def _parse_args():
     import argparse
@@ -322,18 +1229,65 @@ def _parse_args():
     ap.add_argument('--trace', default=False, action=bool_action, help='show pytest outputs, etc.')
     ap.add_argument('--save-to', type=Path, help='file where to save results (JSON)')
     ap.add_argument('--pytest-args', type=str, default='', help='extra arguments to pass to pytest')
+    ap.add_argument('--flaky', default=False, action=bool_action,
+                    help='repeat trials as needed to reduce an intermittent failure')
+    ap.add_argument('--flaky-runs', type=int, default=10,
+                    help='maximum number of runs per trial (and baseline runs) in --flaky mode')
+    ap.add_argument('--confidence', type=float, default=.95,
+                    help='confidence required to decide on a trial in --flaky mode')
+    ap.add_argument('--jobs', type=int, help='number of trials to run concurrently')
+    ap.add_argument('--trial-timeout-factor', type=float, default=10,
+                    help='time out trials taking this many times longer than expected from the'
+                         ' initial run (0 to disable)')
+    ap.add_argument('--trial-timeout-min', type=float, default=60,
+                    help='minimum time (in seconds) to allow a trial before timing out')
+    ap.add_argument('--timeout-means', choices=['fails', 'inconclusive'], default='inconclusive',
+                    help='how to interpret a trial timing out')
+    ap.add_argument('--strategy', choices=['bisect', 'scan'], default='bisect',
+                    help='how to look for the polluter: by bisecting the modules and tests, or by scanning them'
+                         ' in a single run that forks a checkpoint running the failing test after each one'
+                         ' (falling back to bisecting if that polluter isn\'t enough by itself)')
+    ap.add_argument('--discover', default=False, action=bool_action,
+                    help='instead of reducing a failure, look for order dependencies among all tests'
+                         ' and save them (see --save-to) as a dependency map')
+    ap.add_argument('--discover-runs', type=int, default=4,
+                    help='number of test orderings to run in --discover mode (at least 2)')
+    ap.add_argument('--seed', type=int, help='random seed for the orderings in --discover mode')
+    ap.add_argument('--dependencies', type=Path,
+                    help='dependency map (from --discover) whose known polluters to try first')
+    ap.add_argument('--queue', type=Path,
+                    help='hand out trials to workers (see --worker) through this directory')
+    ap.add_argument('--worker', type=Path, metavar='QUEUE',
+                    help='run as a worker, executing trials handed out through the given --queue directory'
+                         ' (--jobs at a time) until interrupted')
     ap.add_argument('--version', action='version',
                     version=f"%(prog)s v{__version__} (Python {'.'.join(map(str, sys.version_info[:3]))})")
-    ap.add_argument('tests_path', type=Path, help='tests file or directory')
+    ap.add_argument('tests_path', type=Path, nargs='?', help='tests file or directory')
 
-    return ap.parse_args()
+    args = ap.parse_args()
+    if args.tests_path is None and not args.worker:
+        ap.error("the tests_path argument is required")
+
+    return args
 
 
 def main():
     args = _parse_args()
     args.pytest_args = args.pytest_args.split()
 
-    results = reduce(**vars(args))
+    if args.worker:
+        work(args.worker, jobs=args.jobs or 1)
+        return 0
+
+    executor = QueueExecutor(args.queue) if args.queue else None
+    try:
+        if args.discover:
+            results = discover(**{**vars(args), 'runs': args.discover_runs}, executor=executor)
+        else:
+            results = reduce(**vars(args), executor=executor)
+    finally:
+        if executor:
+            executor.shutdown()
     if args.save_to:
         with args.save_to.open("w") as f:
             json.dump(results, f)
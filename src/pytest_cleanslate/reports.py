@@ -0,0 +1,61 @@
+import pytest
+from pathlib import Path
+import hashlib
+import pickle
+import typing as T
+
+
+def iter_reports(retval: T.Any) -> T.Iterator[T.Union[pytest.TestReport, pytest.CollectReport]]:
+    """Finds the reports in a forked child's return value."""
+    if isinstance(retval, (pytest.TestReport, pytest.CollectReport)):
+        yield retval
+    elif isinstance(retval, (list, tuple)):
+        for value in retval:
+            yield from iter_reports(value)
+    elif isinstance(retval, dict):
+        for value in retval.values():
+            yield from iter_reports(value)
+
+
+def _artifacts_dir(config: pytest.Config) -> Path:
+    if getattr(config, "cache", None) is not None:
+        return config.cache.mkdir("cleanslate-artifacts")
+
+    import tempfile
+    path = Path(tempfile.gettempdir()) / "pytest-cleanslate-artifacts"
+    path.mkdir(exist_ok=True)
+    return path
+
+
+def _truncate(config: pytest.Config, content: str, max_size: int) -> str:
+    """Truncates a section's content, saving the full content to a file.  The result fits in
+       `max_size` (space permitting), so that truncating it again, as it gets relayed from
+       a forked child's own children, doesn't change it."""
+    path = _artifacts_dir(config) / f"{hashlib.sha256(content.encode('utf-8')).hexdigest()[:16]}.txt"
+    path.write_text(content, encoding='utf-8')
+
+    message = f"\n... {len(content)} characters in total; full output in {path} ...\n"
+    half = max(max_size - len(message), 0) // 2
+    return f"{content[:half]}{message}{content[len(content)-half:]}"
+
+
+def shrink_reports(config: pytest.Config, reports: T.List[pytest.TestReport]) -> None:
+    """Reduces the size of reports (captured output, etc.) to be sent back from a forked child."""
+    max_size = config.getoption("cleanslate_max_section")
+    seen = {}
+
+    for rep in reports:
+        sections = []
+        for name, content in rep.sections:
+            if max_size and len(content) > max_size:
+                content = _truncate(config, content, max_size)
+
+            # pickle only includes repeated objects once, so we make equal contents identical
+            sections.append((name, seen.setdefault(content, content)))
+
+        rep.sections = sections
+
+
+def report_sizes(reports: T.List[pytest.TestReport]) -> T.List[T.Tuple[str, str, int]]:
+    """Returns the pickled size of each report, for finding the largest ones."""
+    return [(rep.nodeid, getattr(rep, 'when', 'collect'), len(pickle.dumps(rep))) for rep in reports]
@@ -0,0 +1,156 @@
+import pytest
+import logging
+import os
+import sys
+import threading
+import types
+import typing as T
+import warnings
+
+
+CACHE_KEY = "cleanslate/needs-fork"
+
+
+class Snapshot:
+    """Snapshot of the interpreter state that test modules commonly change, so that a module
+       can run in this process and its changes be rolled back afterwards.  Modules imported
+       since the snapshot are removed, as are attributes added to previously imported modules;
+       attributes of those modules that were rebound or deleted are restored, but reported
+       (unless private, as those are mostly lazily initialized caches), as whatever used their
+       other values may still hold on to them.  Changes within the attributes' values (such as
+       to a dict's contents) aren't detected."""
+
+    # modules whose attributes are rebound as a matter of course (such as sys.stdout)
+    VOLATILE_MODULES = {'sys', 'builtins'}
+
+    def __init__(self):
+        self._modules = dict(sys.modules)
+        # module subclasses (such as apipkg's) may add attributes as they lazily load them
+        self._module_values = {name: dict(m.__dict__) for name, m in self._modules.items()
+                               if type(m) is types.ModuleType}
+        self._path = list(sys.path)
+        self._meta_path = list(sys.meta_path)
+        self._environ = dict(os.environ)
+        self._cwd = os.getcwd()
+        self._filters = list(warnings.filters)
+        self._threads = set(threading.enumerate())
+
+        manager = logging.Logger.manager
+        self._loggers = {name: (lg.level, list(lg.handlers), lg.propagate, lg.disabled)
+                         for name, lg in [('', logging.root), *manager.loggerDict.items()]
+                         if isinstance(lg, logging.Logger)}
+        self._logger_names = set(manager.loggerDict)
+
+
+    def restore(self) -> T.List[str]:
+        """Rolls back the changes since the snapshot, returning a description of those
+           it couldn't roll back (if any)."""
+        problems = []
+
+        for name in [n for n in sys.modules if n not in self._modules]:
+            module = sys.modules.pop(name)
+            parent, _, child = name.rpartition('.')
+            if parent and getattr(self._modules.get(parent), child, None) is module:
+                delattr(self._modules[parent], child)
+        sys.modules.update(self._modules)
+
+        for name, values in self._module_values.items():
+            d = self._modules[name].__dict__
+            for key in [k for k in d if k not in values]:
+                del d[key]
+            if len(d) != len(values):
+                problems.append(f"attributes deleted from module {name}")
+            if name in self.VOLATILE_MODULES:
+                continue
+            if (rebound := [k for k, v in d.items() if v is not values[k] and not k.startswith('_')]):
+                problems.append(f"attributes rebound in module {name}: {', '.join(rebound)}")
+            d.update(values)
+
+        sys.path[:] = self._path
+        sys.meta_path[:] = self._meta_path
+
+        if os.environ != self._environ:
+            os.environ.clear()
+            os.environ.update(self._environ)
+
+        if os.getcwd() != self._cwd:
+            os.chdir(self._cwd)
+
+        if warnings.filters != self._filters:
+            warnings.filters[:] = self._filters
+            if (filters_mutated := getattr(warnings, '_filters_mutated', None)):
+                filters_mutated()   # invalidates the "already warned" registries
+
+        manager = logging.Logger.manager
+        for name in [n for n in manager.loggerDict if n not in self._logger_names]:
+            del manager.loggerDict[name]
+        for name, (level, handlers, propagate, disabled) in self._loggers.items():
+            lg = logging.getLogger(name or None)
+            lg.setLevel(level)
+            lg.handlers[:] = handlers
+            lg.propagate, lg.disabled = propagate, disabled
+
+        if (threads := [t.name for t in threading.enumerate() if t not in self._threads]):
+            problems.append(f"threads still running: {', '.join(threads)}")
+
+        return problems
+
+
+    def changes(self) -> T.List[str]:
+        """Describes the changes since the snapshot, other than modules imported (and their
+           loggers), without rolling them back."""
+        changes = []
+
+        new_modules = {n for n in sys.modules if n not in self._modules}
+        for name, values in self._module_values.items():
+            d = self._modules[name].__dict__
+            if (any(k not in values and k != '__warningregistry__' and f"{name}.{k}" not in new_modules for k in d)
+                or any(k not in d or (d[k] is not v and not k.startswith('_') and name not in self.VOLATILE_MODULES)
+                       for k, v in values.items())):
+                changes.append(f"module {name}")
+
+        if sys.path != self._path:
+            changes.append("sys.path")
+        if sys.meta_path != self._meta_path:
+            changes.append("sys.meta_path")
+        if os.environ != self._environ:
+            changes.append("os.environ")
+        if os.getcwd() != self._cwd:
+            changes.append("current directory")
+        if warnings.filters != self._filters:
+            changes.append("warnings filters")
+
+        for name, state in self._loggers.items():
+            lg = logging.getLogger(name or None)
+            if (lg.level, lg.handlers, lg.propagate, lg.disabled) != state:
+                changes.append(f"logger {name or 'root'}")
+
+        if (threads := [t.name for t in threading.enumerate() if t not in self._threads]):
+            changes.append(f"threads started: {', '.join(threads)}")
+
+        return changes
+
+
+class NeedsFork:
+    """Remembers, across sessions, the modules that changed state that --cleanslate-mode=restore
+       couldn't roll back, so that they're forked from then on."""
+
+    def __init__(self, config: pytest.Config):
+        self._config = config
+        self._cache = getattr(config, "cache", None)
+        self._modules = set(self._cache.get(CACHE_KEY, [])) if self._cache else set()
+        self.new: T.Dict[str, T.List[str]] = {}
+
+
+    def __contains__(self, nodeid: str) -> bool:
+        return nodeid in self._modules
+
+
+    def add(self, nodeid: str, problems: T.List[str]) -> None:
+        self._modules.add(nodeid)
+        self.new[nodeid] = problems
+
+
+    def save(self) -> None:
+        if self._cache and self.new:
+            self._cache.set(CACHE_KEY, sorted(self._modules))
@@ -0,0 +1,96 @@
+import pytest
+import os
+import typing as T
+
+
+CACHE_KEY = "cleanslate/peak-rss"
+
+
+def available_memory() -> T.Optional[int]:
+    """Returns the memory available for starting new processes (in kB), if known."""
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+
+    return None
+
+
+def process_rss(pid: int) -> int:
+    """Returns the process' current resident set size (in kB), or 0 if unknown."""
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+
+    return 0
+
+
+class Scheduler:
+    """Decides when to start another forked child, so that children fan out as far as the system's
+       load and available memory allow.  The memory a module's child needs is estimated from its
+       peak RSS in earlier runs; modules that need much of the available memory run by themselves."""
+
+    MEMORY_FRACTION = .8        # of the available memory that children may expect to use
+    DEFAULT_RSS = 100 * 1024    # kB, for when there's no history
+
+    def __init__(self, config: pytest.Config, *, max_jobs: int):
+        self._cache = getattr(config, "cache", None)
+        self._peaks: T.Dict[str, int] = self._cache.get(CACHE_KEY, {}) if self._cache else {}
+        self._max_jobs = max_jobs
+        self._cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+
+
+    def expected_rss(self, nodeid: str) -> int:
+        if (peak := self._peaks.get(nodeid)) is not None:
+            return peak
+
+        if self._peaks:
+            peaks = sorted(self._peaks.values())
+            return peaks[len(peaks)//2]
+
+        return self.DEFAULT_RSS
+
+
+    def record(self, nodeid: str, max_rss: int) -> None:
+        self._peaks[nodeid] = max_rss
+
+
+    def admit(self, nodeid: str, running: T.Dict[str, int]) -> bool:
+        """Decides whether to start the given module's child while those given (node ID to pid)
+           are running.  A child is always admitted if none are running, so that we progress."""
+        if not running:
+            return True
+
+        if len(running) >= self._max_jobs:
+            return False
+
+        try:
+            if os.getloadavg()[0] >= self._cpus:
+                return False
+        except (AttributeError, OSError):
+            pass
+
+        if (available := available_memory()) is None:
+            return True
+
+        budget = available * self.MEMORY_FRACTION
+        needed = self.expected_rss(nodeid)
+        if needed > budget / 2:
+            return False
+
+        # MemAvailable already accounts for what the running children use now, but not for
+        # what they may still grow to use
+        growth = sum(max(0, self.expected_rss(n) - process_rss(pid)) for n, pid in running.items())
+        return needed + growth <= budget
+
+
+    def save(self) -> None:
+        if self._cache:
+            self._cache.set(CACHE_KEY, self._peaks)
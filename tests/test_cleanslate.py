@@ -1,6 +1,7 @@
 import pytest
 import sys
 import subprocess
+import os
 from pathlib import Path
 import json
 import random
@@ -337,3 +338,707 @@ def test_closes_stdout_stderr(tests_dir):
 
     p = subprocess.run([sys.executable, '-m', 'pytest', '--cleanslate', tests_dir], check=False)
     assert p.returncode == pytest.ExitCode.OK
+
+
+def test_cow(tests_dir):
+    make_polluted_suite(tests_dir, pollute_in_collect=True, fail_collect=False)
+
+    p = subprocess.run([sys.executable, '-m', 'pytest', '--cleanslate', '--cleanslate-cow', tests_dir],
+                       check=False, capture_output=True)
+    print(str(p.stdout, 'utf-8'))
+    assert p.returncode == pytest.ExitCode.OK
+    if Path('/proc/self/smaps_rollup').exists():
+        assert 'cleanslate memory usage' in str(p.stdout, 'utf-8')
+        assert str(p.stdout, 'utf-8').count(': USS') == 10
+
+
+@pytest.mark.parametrize("batch", ['item', 'parent', 'file'])
+def test_batch_doctests(tests_dir, batch):
+    (tests_dir / "doc.txt").write_text(dedent("""\
+        >>> import os
+        >>> with open('pids.txt', 'a') as f: _ = f.write(f"{os.getpid()}\\n")
+        >>> 1 + 1
+        2
+        """))
+
+    (tests_dir / "mod.py").write_text(dedent("""\
+        def one():
+            '''
+            >>> import os
+            >>> with open('pids.txt', 'a') as f: _ = f.write(f"{os.getpid()}\\\\n")
+            >>> one()
+            1
+            '''
+            return 1
+
+        def two():
+            '''
+            >>> import os
+            >>> with open('pids.txt', 'a') as f: _ = f.write(f"{os.getpid()}\\\\n")
+            >>> two()
+            3
+            '''
+            return 2
+        """))
+
+    p = subprocess.run([sys.executable, '-m', 'pytest', '--cleanslate', f'--cleanslate-batch={batch}',
+                        '--doctest-modules', '--doctest-glob=*.txt', '-rA', tests_dir],
+                       check=False, capture_output=True)
+    print(str(p.stdout, 'utf-8'))
+    assert p.returncode == pytest.ExitCode.TESTS_FAILED
+    assert 'PASSED tests/doc.txt::doc.txt' in str(p.stdout, 'utf-8')
+    assert 'PASSED tests/mod.py::mod.one' in str(p.stdout, 'utf-8')
+    assert 'FAILED tests/mod.py::mod.two' in str(p.stdout, 'utf-8')
+
+    pids = Path('pids.txt').read_text().split()
+    assert len(pids) == 3
+    assert len(set(pids)) == (3 if batch == 'item' else 2)
+
+
+def test_batch_crash(tests_dir):
+    (tests_dir / "mod.py").write_text(dedent("""\
+        def a():
+            '''
+            >>> with open('runs.txt', 'a') as f: _ = f.write("a\\\\n")
+            '''
+
+        def b():
+            '''
+            >>> with open('runs.txt', 'a') as f: _ = f.write("b\\\\n")
+            '''
+
+        def c():
+            '''
+            >>> import os
+            >>> with open('runs.txt', 'a') as f: _ = f.write("c\\\\n")
+            >>> os._exit(1)
+            '''
+        """))
+
+    p = subprocess.run([sys.executable, '-m', 'pytest', '--cleanslate', '--cleanslate-batch=file',
+                        '--doctest-modules', '-rA', tests_dir],
+                       check=False, capture_output=True)
+    print(str(p.stdout, 'utf-8'))
+    assert p.returncode == pytest.ExitCode.TESTS_FAILED
+    assert 'PASSED tests/mod.py::mod.a' in str(p.stdout, 'utf-8')
+    assert 'PASSED tests/mod.py::mod.b' in str(p.stdout, 'utf-8')
+    assert 'FAILED tests/mod.py::mod.c' in str(p.stdout, 'utf-8')
+
+    # once in the batch that crashed, then once each individually
+    assert Path('runs.txt').read_text().split() == ['a', 'b', 'c', 'a', 'b', 'c']
+
+
+def test_cache(tests_dir):
+    for seq in range(3):
+        seq2p(tests_dir, seq).write_text(dedent(f"""\
+            import helper
+
+            def test_foo():
+                with open('runs.txt', 'a') as f:
+                    f.write('{seq}\\n')
+                assert helper.VALUE == 0 or {seq} != 2
+            """))
+    (tests_dir / "helper.py").write_text("VALUE = 0\n")
+
+    def run(*args):
+        if Path('runs.txt').exists():
+            Path('runs.txt').unlink()
+
+        p = subprocess.run([sys.executable, '-m', 'pytest', '--cleanslate', '--cleanslate-cache', *args,
+                            tests_dir], check=False, capture_output=True)
+        print(str(p.stdout, 'utf-8'))
+        return p.returncode, (Path('runs.txt').read_text().split() if Path('runs.txt').exists() else [])
+
+    assert run() == (pytest.ExitCode.OK, ['0', '1', '2'])
+    assert run() == (pytest.ExitCode.OK, [])
+
+    seq2p(tests_dir, 1).write_text(seq2p(tests_dir, 1).read_text() + "\n")
+    assert run() == (pytest.ExitCode.OK, ['1'])
+
+    # imported project files are inputs, too
+    (tests_dir / "helper.py").write_text("VALUE = 1\n")
+    assert run() == (pytest.ExitCode.TESTS_FAILED, ['0', '1', '2'])
+    assert run() == (pytest.ExitCode.TESTS_FAILED, [])
+
+    # so are the arguments
+    assert run('-k', 'foo') == (pytest.ExitCode.TESTS_FAILED, ['0', '1', '2'])
+
+    assert run('--cleanslate-cache-clear') == (pytest.ExitCode.TESTS_FAILED, ['0', '1', '2'])
+
+
+@pytest.mark.parametrize("mode", ['fork', 'restore'])
+def test_cache_imports_in_tests(tests_dir, mode):
+    seq2p(tests_dir, 0).write_text(dedent("""\
+        def test_foo():
+            import helper
+            assert helper.VALUE == 0
+        """))
+    (tests_dir / "helper.py").write_text("VALUE = 0\n")
+
+    def run():
+        p = subprocess.run([sys.executable, '-m', 'pytest', '--cleanslate', '--cleanslate-cache',
+                            f'--cleanslate-mode={mode}', tests_dir], check=False, capture_output=True)
+        print(str(p.stdout, 'utf-8'))
+        return p.returncode
+
+    assert run() == pytest.ExitCode.OK
+    (tests_dir / "helper.py").write_text("VALUE = 1\n")
+    assert run() == pytest.ExitCode.TESTS_FAILED
+
+
+def test_cache_configuration(tests_dir, monkeypatch):
+    seq2p(tests_dir, 0).write_text(dedent("""\
+        import warnings
+
+        def test_foo():
+            warnings.warn("deprecated", DeprecationWarning)
+        """))
+    Path("pytest.ini").write_text("[pytest]\n")
+
+    def run():
+        p = subprocess.run([sys.executable, '-m', 'pytest', '--cleanslate', '--cleanslate-cache', tests_dir],
+                           check=False, capture_output=True)
+        print(str(p.stdout, 'utf-8'))
+        return p.returncode
+
+    assert run() == pytest.ExitCode.OK
+
+    # the configuration file is an input
+    Path("pytest.ini").write_text("[pytest]\nfilterwarnings = error\n")
+    assert run() == pytest.ExitCode.TESTS_FAILED
+
+    Path("pytest.ini").write_text("[pytest]\n")
+    assert run() == pytest.ExitCode.OK
+
+    # ...and so are the arguments from PYTEST_ADDOPTS
+    monkeypatch.setenv("PYTEST_ADDOPTS", "-W error::DeprecationWarning")
+    assert run() == pytest.ExitCode.TESTS_FAILED
+
+def test_collect_only(tests_dir):
+    seq2p(tests_dir, 1).write_text(dedent("""\
+        import pytest
+        from pathlib import Path
+
+        with open('imported.txt', 'a') as f:
+            f.write('.')
+
+        class TestClass:
+            @pytest.mark.slow
+            def test_foo(self):
+                pass
+
+        @pytest.mark.parametrize("x", [1, 2])
+        def test_bar(x):
+            pass
+        """))
+    seq2p(tests_dir, 2).write_text(dedent("""\
+        def test_baz():
+            pass
+        """))
+
+    def collect(*args):
+        p = subprocess.run([sys.executable, '-m', 'pytest', '--cleanslate', '--collect-only', '-q', *args,
+                            tests_dir], check=False, capture_output=True)
+        print(str(p.stdout, 'utf-8'))
+        assert p.returncode == pytest.ExitCode.OK
+        assert 'PytestUnknownMarkWarning' not in str(p.stdout, 'utf-8')
+        return [l for l in str(p.stdout, 'utf-8').splitlines() if '::' in l]
+
+    assert collect() == [
+        f"{seq2p(tests_dir, 1)}::TestClass::test_foo",
+        f"{seq2p(tests_dir, 1)}::test_bar[1]",
+        f"{seq2p(tests_dir, 1)}::test_bar[2]",
+        f"{seq2p(tests_dir, 2)}::test_baz",
+    ]
+    assert Path('imported.txt').read_text() == '.'
+
+    # index is reused
+    assert collect('-m', 'slow') == [f"{seq2p(tests_dir, 1)}::TestClass::test_foo"]
+    assert collect('-k', 'bar and not 2') == [f"{seq2p(tests_dir, 1)}::test_bar[1]"]
+    assert Path('imported.txt').read_text() == '.'
+
+    # ...unless stale
+    seq2p(tests_dir, 1).write_text(seq2p(tests_dir, 1).read_text() + "\n")
+    assert len(collect()) == 4
+    assert Path('imported.txt').read_text() == '..'
+
+
+def test_skip_deselected_modules(tests_dir):
+    for seq in range(3):
+        seq2p(tests_dir, seq).write_text(dedent(f"""\
+            import pytest
+
+            with open('imported.txt', 'a') as f:
+                f.write('{seq}\\n')
+
+            @pytest.mark.{'slow' if seq == 1 else 'fast'}
+            def test_foo_{seq}():
+                pass
+            """))
+
+    def run(*args):
+        if Path('imported.txt').exists():
+            Path('imported.txt').unlink()
+
+        p = subprocess.run([sys.executable, '-m', 'pytest', '--cleanslate', '--cleanslate-index', *args, tests_dir],
+                           check=False, capture_output=True)
+        print(str(p.stdout, 'utf-8'))
+        return p.returncode, Path('imported.txt').read_text().split() if Path('imported.txt').exists() else []
+
+    # nothing indexed yet
+    assert run('-k', 'foo_1') == (pytest.ExitCode.OK, ['0', '1', '2'])
+
+    assert run('-k', 'foo_1') == (pytest.ExitCode.OK, ['1'])
+    assert run('-m', 'not slow') == (pytest.ExitCode.OK, ['0', '2'])
+    assert run('--deselect', f"{seq2p(tests_dir, 0)}::test_foo_0") == (pytest.ExitCode.OK, ['1', '2'])
+    assert run('-k', 'nothing') == (pytest.ExitCode.NO_TESTS_COLLECTED, [])
+
+    # stale modules take the safe path
+    seq2p(tests_dir, 2).write_text(seq2p(tests_dir, 2).read_text() + "\n")
+    assert run('-k', 'foo_1') == (pytest.ExitCode.OK, ['1', '2'])
+
+
+def test_index_depends_on_args(tests_dir, monkeypatch):
+    (tests_dir / "conftest.py").write_text(dedent("""\
+        def pytest_addoption(parser):
+            parser.addoption("--env", default="a")
+            parser.addini("env", "environment, overriding --env")
+
+        def pytest_generate_tests(metafunc):
+            if "env" in metafunc.fixturenames:
+                metafunc.parametrize("env", [metafunc.config.getini("env") or metafunc.config.getoption("env")])
+        """))
+    seq2p(tests_dir, 0).write_text(dedent("""\
+        def test_x(env):
+            with open('runs.txt', 'a') as f:
+                f.write(f"{env}\\n")
+        """))
+
+    def run(*args):
+        p = subprocess.run([sys.executable, '-m', 'pytest', '--cleanslate', '--cleanslate-index', *args, tests_dir],
+                           check=False, capture_output=True)
+        print(str(p.stdout, 'utf-8'))
+        return p.returncode
+
+    assert run('--env=a') == pytest.ExitCode.OK
+    assert run('--env=b', '-k', 'b') == pytest.ExitCode.OK
+    assert Path('runs.txt').read_text().split() == ['a', 'b']
+
+    # arguments from PYTEST_ADDOPTS count, too
+    assert run('-k', 'a') == pytest.ExitCode.OK
+    monkeypatch.setenv("PYTEST_ADDOPTS", "--env=c")
+    assert run('-k', 'c') == pytest.ExitCode.OK
+    monkeypatch.delenv("PYTEST_ADDOPTS")
+    assert Path('runs.txt').read_text().split() == ['a', 'b', 'a', 'c']
+
+    # ...as does the configuration file
+    Path("pytest.ini").write_text("[pytest]\n")
+    assert run('-k', 'a') == pytest.ExitCode.OK
+    Path("pytest.ini").write_text("[pytest]\nenv = d\n")
+    assert run('-k', 'd') == pytest.ExitCode.OK
+    assert Path('runs.txt').read_text().split() == ['a', 'b', 'a', 'c', 'a', 'd']
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_report_size_controls(tests_dir, compress):
+    seq2p(tests_dir, 1).write_text(dedent("""\
+        def test_noisy():
+            print('begin' + 'x' * 100_000 + 'end')
+            assert False
+
+        def test_quiet():
+            print('hello')
+        """))
+
+    p = subprocess.run([sys.executable, '-m', 'pytest', '--cleanslate', '--cleanslate-max-section=1000',
+                        '--cleanslate-report-sizes=2', *(('--cleanslate-compress',) if compress else ()),
+                        '-rA', tests_dir], check=False, capture_output=True)
+    output = str(p.stdout, 'utf-8')
+    print(output)
+    assert p.returncode == pytest.ExitCode.TESTS_FAILED
+    assert 'hello' in output
+    assert 'xxxxxend' in output
+    assert 'x' * 2000 not in output
+    assert 'characters in total' in output
+
+    artifacts = list(Path('.pytest_cache/d/cleanslate-artifacts').glob('*.txt'))
+    assert len(artifacts) == 1
+    assert 'x' * 100_000 in artifacts[0].read_text()
+
+    assert 'cleanslate largest reports' in output
+    assert f"{seq2p(tests_dir, 1)}::test_noisy (call)" in output
+
+
+@pytest.mark.parametrize("pollute_in_collect", [False, True])
+def test_restore_mode(tests_dir, pollute_in_collect):
+    make_polluted_suite(tests_dir, pollute_in_collect=pollute_in_collect, fail_collect=False)
+
+    (tests_dir / "test_pids.py").write_text(dedent("""\
+        import os
+
+        def test_pid():
+            with open('pids.txt', 'a') as f: f.write(f"{os.getpid()}\\n")
+        """))
+    (tests_dir / "test_forked.py").write_text(dedent("""\
+        import os
+        import pytest
+
+        pytestmark = pytest.mark.cleanslate_fork
+
+        def test_pid():
+            with open('pids.txt', 'a') as f: f.write(f"{os.getpid()}\\n")
+        """))
+    (tests_dir / "test_thread.py").write_text(dedent("""\
+        import threading
+        import time
+
+        threading.Thread(target=time.sleep, args=(1,), name='sleeper').start()
+
+        def test_nothing():
+            pass
+        """))
+    (tests_dir / "test_rebind.py").write_text(dedent("""\
+        import json
+
+        def test_rebind():
+            json.dumps = lambda *args, **kwargs: 'polluted'
+        """))
+    (tests_dir / "test_zz_json.py").write_text(dedent("""\
+        import json
+
+        def test_json():
+            assert json.dumps(1) == '1'
+        """))
+
+    p = subprocess.run([sys.executable, '-m', 'pytest', '--cleanslate',
+                        '--cleanslate-mode=restore', tests_dir], check=False, capture_output=True)
+    print(str(p.stdout, 'utf-8'))
+    assert p.returncode == pytest.ExitCode.OK
+    assert "test_thread.py (threads still running: sleeper); it will be forked" in str(p.stdout, 'utf-8')
+    assert "test_rebind.py (attributes rebound in module json: dumps); it will be forked" in str(p.stdout, 'utf-8')
+    assert len(set(Path('pids.txt').read_text().split())) == 2
+
+    p = subprocess.run([sys.executable, '-m', 'pytest', '--cleanslate',
+                        '--cleanslate-mode=restore', tests_dir], check=False, capture_output=True)
+    assert p.returncode == pytest.ExitCode.OK
+    assert "couldn't roll back" not in str(p.stdout, 'utf-8')
+
+
+@pytest.mark.parametrize("mode", ['fork', 'restore'])
+def test_other_plugins_protocol(tests_dir, mode):
+    (tests_dir / "conftest.py").write_text(dedent("""\
+        import pytest
+
+        @pytest.hookimpl(hookwrapper=True)
+        def pytest_runtest_protocol(item, nextitem):
+            with open('protocol.txt', 'a') as f: f.write(f"{item.name}\\n")
+            yield
+        """))
+    seq2p(tests_dir, 0).write_text(dedent("""\
+        def test_a():
+            pass
+        """))
+    seq2p(tests_dir, 1).write_text(dedent("""\
+        def test_b():
+            assert False
+
+        def test_c():
+            pass
+        """))
+
+    def run(*args):
+        if Path('protocol.txt').exists():
+            Path('protocol.txt').unlink()
+
+        p = subprocess.run([sys.executable, '-m', 'pytest', '--cleanslate', f'--cleanslate-mode={mode}',
+                            *args, tests_dir], check=False, capture_output=True)
+        print(str(p.stdout, 'utf-8'))
+        assert p.returncode == pytest.ExitCode.TESTS_FAILED
+        return str(p.stdout, 'utf-8'), [l for l in Path('protocol.txt').read_text().split() if 'test_' in l]
+
+    output, protocols = run()
+    assert "1 failed, 2 passed" in output
+    assert {'test_a', 'test_b', 'test_c'} <= set(protocols)
+
+    output, protocols = run('-x')
+    assert "1 failed, 1 passed" in output
+    assert 'test_c' not in protocols
+
+
+def test_restore_mode_forks_known_polluters(tests_dir):
+    for name in ("test_a.py", "test_b.py", "test_c.py"):
+        (tests_dir / name).write_text(dedent("""\
+            import os
+
+            def test_pid():
+                with open('pids.txt', 'a') as f: f.write(f"{os.getpid()}\\n")
+            """))
+
+    dependencies = Path("dependencies.json")
+    dependencies.write_text(json.dumps({'dependencies': [
+        {'victim': f"{tests_dir / 'test_c.py'}::test_pid", 'kind': 'polluter',
+         'tests': [f"{tests_dir / 'test_a.py'}::test_pid"]},
+        {'victim': f"{tests_dir / 'test_c.py'}::test_pid", 'kind': 'setter',
+         'tests': [f"{tests_dir / 'test_b.py'}::test_pid"]},
+    ]}))
+
+    p = subprocess.run([sys.executable, '-m', 'pytest', '--cleanslate', '--cleanslate-mode=restore',
+                        f'--cleanslate-dependencies={dependencies}', tests_dir], check=False)
+    assert p.returncode == pytest.ExitCode.OK
+    assert len(set(Path('pids.txt').read_text().split())) == 2
+
+
+def test_child_finished_hook(tests_dir):
+    (tests_dir / "conftest.py").write_text(dedent("""\
+        import json
+
+        def pytest_cleanslate_child_finished(item, stats):
+            with open('stats.jsonl', 'a') as f:
+                f.write(json.dumps({'item': item.nodeid, **stats}) + '\\n')
+        """))
+    seq2p(tests_dir, 0).write_text(dedent("""\
+        def test_one():
+            pass
+
+        def test_two():
+            pass
+        """))
+    seq2p(tests_dir, 1).write_text(dedent("""\
+        import os
+
+        def test_crash():
+            os._exit(1)
+        """))
+
+    p = subprocess.run([sys.executable, '-m', 'pytest', '--cleanslate', tests_dir],
+                       check=False, capture_output=True)
+    print(str(p.stdout, 'utf-8'))
+    assert p.returncode == pytest.ExitCode.TESTS_FAILED
+
+    stats = [json.loads(line) for line in Path('stats.jsonl').read_text().splitlines()]
+    by_nodeid = {s['nodeid']: s for s in stats}
+    assert len(stats) == len(by_nodeid) == 5    # 2 modules, 3 tests
+
+    module = by_nodeid[f"{seq2p(tests_dir, 0)}::{seq2p(tests_dir, 0).name}"]
+    test = by_nodeid[f"{seq2p(tests_dir, 0)}::test_one"]
+    crashed = by_nodeid[f"{seq2p(tests_dir, 1)}::test_crash"]
+
+    assert test['item'] == module['item'] == module['nodeid']
+    for s in stats:
+        assert s['wall_time'] >= 0 and s['cpu_time'] >= 0 and s['max_rss'] > 0
+    assert module['exit_status'] == module['signal'] == 0
+    assert module['reports'] == 6 and module['payload_size'] > 0
+    assert test['reports'] == 3
+    assert crashed['exit_status'] == 1 and crashed['reports'] == 1 and crashed['payload_size'] == 0
+
+
+def test_parallel(tests_dir):
+    failing, polluter, tests = make_polluted_suite(tests_dir, pollute_in_collect=True, fail_collect=False)
+    for seq in range(10, 14):
+        seq2p(tests_dir, seq).write_text(dedent("""\
+            import os
+            import time
+
+            def test_sleep():
+                with open('times.txt', 'a') as f: f.write(f"{time.time()} 1\\n")
+                time.sleep(.5)
+                with open('times.txt', 'a') as f: f.write(f"{time.time()} -1\\n")
+            """))
+
+    p = subprocess.run([sys.executable, '-m', 'pytest', '--cleanslate', '--cleanslate-parallel',
+                        '--cleanslate-jobs=4', '-v', tests_dir], check=False, capture_output=True)
+    print(str(p.stdout, 'utf-8'))
+    assert p.returncode == pytest.ExitCode.OK
+
+    # the reports are still in order
+    output = str(p.stdout, 'utf-8')
+    assert [output.index(f"{seq2p(tests_dir, seq)}::") for seq in range(14)] == \
+           sorted(output.index(f"{seq2p(tests_dir, seq)}::") for seq in range(14))
+
+    # some tests ran at the same time, unless the system was too busy for that
+    events = sorted(tuple(map(float, line.split())) for line in Path('times.txt').read_text().splitlines())
+    running = [sum(change for _, change in events[:i+1]) for i in range(len(events))]
+    assert max(running) > 1 or os.getloadavg()[0] >= len(os.sched_getaffinity(0)) - 1
+
+    assert json.loads((Path(".pytest_cache") / "v" / "cleanslate" / "peak-rss").read_text())
+
+
+def test_parallel_wall_time(tests_dir):
+    (tests_dir / "conftest.py").write_text(dedent("""\
+        import json
+
+        def pytest_cleanslate_child_finished(item, stats):
+            with open('stats.jsonl', 'a') as f:
+                f.write(json.dumps({'item': item.nodeid, **stats}) + '\\n')
+        """))
+    seq2p(tests_dir, 0).write_text(dedent("""\
+        import time
+
+        def test_slow():
+            time.sleep(1.5)
+        """))
+    seq2p(tests_dir, 1).write_text(dedent("""\
+        def test_fast():
+            pass
+        """))
+
+    p = subprocess.run([sys.executable, '-m', 'pytest', '--cleanslate', '--cleanslate-parallel',
+                        '--cleanslate-jobs=2', tests_dir], check=False, capture_output=True)
+    print(str(p.stdout, 'utf-8'))
+    assert p.returncode == pytest.ExitCode.OK
+
+    # started ahead, the fast module's child is only reaped after the slow one's,
+    # but that wait isn't part of its wall time
+    stats = {s['nodeid']: s for s in map(json.loads, Path('stats.jsonl').read_text().splitlines())}
+    assert stats[f"{seq2p(tests_dir, 1)}::{seq2p(tests_dir, 1).name}"]['wall_time'] < .75
+
+
+def test_scheduler(monkeypatch):
+    from types import SimpleNamespace
+    import pytest_cleanslate.scheduler as scheduler
+
+    s = scheduler.Scheduler(SimpleNamespace(cache=None), max_jobs=3)
+    s.record('light.py::light.py', 100)
+    s.record('heavy.py::heavy.py', 6_000)
+
+    monkeypatch.setattr(scheduler, "available_memory", lambda: 10_000)
+    monkeypatch.setattr(scheduler, "process_rss", lambda pid: 50)
+    monkeypatch.setattr(scheduler.os, "getloadavg", lambda: (0, 0, 0))
+
+    assert s.admit('heavy.py::heavy.py', {})
+    assert not s.admit('heavy.py::heavy.py', {'light.py::light.py': 1})
+    assert s.admit('light.py::light.py', {'heavy.py::heavy.py': 1})
+    assert not s.admit('light.py::light.py', {'a': 1, 'b': 2, 'c': 3})  # max_jobs
+    assert s.expected_rss('unknown.py::unknown.py') in (100, 6_000)
+
+    monkeypatch.setattr(scheduler, "process_rss", lambda pid: 0)
+    assert not s.admit('light.py::light.py', {'heavy.py::heavy.py': 1, 'other.py::other.py': 2})
+
+    monkeypatch.setattr(scheduler.os, "getloadavg", lambda: (1000, 0, 0))
+    assert not s.admit('light.py::light.py', {'heavy.py::heavy.py': 1})
+
+
+@pytest.mark.parametrize("doctests", [False, True])
+def test_coverage(tests_dir, doctests):
+    coverage = pytest.importorskip("coverage")
+
+    pkg = Path("pkg")
+    pkg.mkdir()
+    (pkg / "__init__.py").write_text(dedent("""\
+        def f(x):
+            if x:
+                return 1
+            return 2
+
+        def g():
+            return 3
+
+        def h():
+            return 4
+        """))
+    seq2p(tests_dir, 0).write_text(dedent("""\
+        import pkg
+
+        def test_f():
+            assert pkg.f(True) == 1
+        """))
+    seq2p(tests_dir, 1).write_text(dedent("""\
+        import pkg
+
+        def test_g():
+            assert pkg.g() == 3
+        """))
+    (tests_dir / "doc.txt").write_text(dedent("""\
+        >>> import pkg
+        >>> pkg.h()
+        4
+        """))
+
+    p = subprocess.run([sys.executable, '-m', 'coverage', 'run', '--branch', '--source=pkg',
+                        '-m', 'pytest', '--cleanslate', '--cleanslate-coverage',
+                        *(('--doctest-glob=*.txt',) if doctests else ()), tests_dir], check=False)
+    assert p.returncode == pytest.ExitCode.OK
+    assert not list(Path(".").glob(".coverage.*"))
+
+    cov = coverage.Coverage()
+    cov.load()
+    _, statements, _, missing, _ = cov.analysis2(str(pkg / "__init__.py"))
+    assert set(missing) == ({4} if doctests else {4, 10})
+    assert cov.get_data().has_arcs()
+
+
+def test_preload(tests_dir):
+    site = Path("site")
+    (site / "goodpkg").mkdir(parents=True)
+    (site / "goodpkg" / "__init__.py").write_text(dedent("""\
+        import os
+        import helper
+
+        with open('imports.txt', 'a') as f: f.write(f"{os.getpid()}\\n")
+        """))
+    (site / "helper.py").write_text("")
+    (site / "badpkg").mkdir()
+    (site / "badpkg" / "__init__.py").write_text(dedent("""\
+        import os
+        os.environ['BADPKG'] = '1'
+        """))
+    (site / "oncepkg.py").write_text("")
+
+    # pretend 'site' is where third-party packages are installed
+    (tests_dir / "conftest.py").write_text(dedent("""\
+        import os
+        import sys
+        import pytest_cleanslate.preload as preload
+
+        site = os.path.join(os.path.realpath('site'), '')
+        sys.path.insert(0, site)
+        site_dirs = preload._site_dirs
+        preload._site_dirs = lambda: [*site_dirs(), site]
+        """))
+
+    for seq in range(3):
+        seq2p(tests_dir, seq).write_text(dedent("""\
+            import goodpkg
+            import badpkg
+
+            def test_foo():
+                pass
+            """))
+    seq2p(tests_dir, 3).write_text(dedent("""\
+        import oncepkg
+
+        def test_foo():
+            pass
+        """))
+
+    p = subprocess.run([sys.executable, '-m', 'pytest', '--cleanslate', '--cleanslate-preload-report=5',
+                        tests_dir], check=False, capture_output=True)
+    output = str(p.stdout, 'utf-8')
+    print(output)
+    assert p.returncode == pytest.ExitCode.OK
+    assert "goodpkg: imported by 3 module(s)" in output
+    assert "badpkg: not recommended, as importing it changed os.environ" in output
+    assert "helper" not in output and "oncepkg" not in output
+    assert len(Path("imports.txt").read_text().split()) == 3
+
+    Path("imports.txt").unlink()
+    p = subprocess.run([sys.executable, '-m', 'pytest', '--cleanslate', '--cleanslate-preload',
+                        tests_dir], check=False, capture_output=True)
+    output = str(p.stdout, 'utf-8')
+    print(output)
+    assert p.returncode == pytest.ExitCode.OK
+    assert "cleanslate: preloaded goodpkg" in output
+    assert len(Path("imports.txt").read_text().split()) == 1     # imported once, before forking
+
+
+def test_invocation_args(monkeypatch):
+    from types import SimpleNamespace
+    from pytest_cleanslate.incremental import invocation_args
+
+    monkeypatch.setenv("PYTEST_ADDOPTS", "-k bar --env 'a b'")
+    config = SimpleNamespace(invocation_params=SimpleNamespace(args=(
+        '--cleanslate', '-k', 'foo', '-mslow', '--deselect=a.py::x', '--deselect', 'b.py::y',
+        '--cleanslate-jobs=2', '--env', 'b', 'tests')),
+        getini=lambda name: ['-ra', '--cleanslate-parallel'] if name == 'addopts' else None)
+    assert invocation_args(config, ignore=("--cleanslate-",), ignore_with_value=("-k", "-m", "--deselect")) == \
+           ['-ra', '--env', 'a b', '--cleanslate', '--env', 'b', 'tests']
@@ -2,6 +2,8 @@ import pytest
 import subprocess
 import typing as T
 import sys
+import time
+import math
 from test_cleanslate import seq2p, tests_dir, make_polluted_suite, FAILURES
 import json
 from textwrap import dedent
@@ -25,6 +27,32 @@ def test_get_function():
     assert 'test_foo' == get_function('test.py::test_foo[1]')
 
 
+def test_trial_cache(tmp_path):
+    from concurrent.futures import Future
+
+    def submitter(results):
+        def submit():
+            future = Future()
+            future.set_result(results)
+            return future
+        return submit
+
+    cache = reduce.TrialCache()
+    results_file = tmp_path / "results.json"
+    results_file.write_text(json.dumps({'collect': [], 'run': [{'id': 'test.py::test_foo', 'outcome': 'passed'}]}))
+    done = Results(results_file)
+    assert cache.submit(('done',), submitter(done)).result() is done
+    assert cache.submit(('done',), submitter(None)).result() is done
+
+    timed_out = Results.timed_out()
+    assert cache.submit(('timeout',), submitter(timed_out)).result() is timed_out
+    assert cache.submit(('timeout',), submitter(done)).result() is done
+
+    cancelled = cache.submit(('cancelled',), Future)
+    assert cancelled.cancel()
+    assert cache.submit(('cancelled',), submitter(done)).result() is done
+
+
 def test_run_pytest_collect_failure(tests_dir):
     test1 = seq2p(tests_dir, 1)
     test1.write_text(dedent("""\
@@ -149,13 +177,14 @@ def test_reduce_test_fails_by_itself(tests_dir, r):
 
 @pytest.mark.parametrize("pollute_in_collect, fail_collect", [[False, False], [True, False], [True, True]])
 @pytest.mark.parametrize("r", [reduce.reduce, cli_reduce])
-def test_reduce(tests_dir, pollute_in_collect, fail_collect, r):
+@pytest.mark.parametrize("strategy", ['bisect', 'scan'])
+def test_reduce(tests_dir, pollute_in_collect, fail_collect, r, strategy):
     failing, polluter, tests = make_polluted_suite(tests_dir, fail_collect=fail_collect,
                                                    pollute_in_collect=pollute_in_collect)
 
     reduction_file = tests_dir.parent / "reduction.json"
 
-    reduction = r(tests_path=tests_dir, trace=True)
+    reduction = r(tests_path=tests_dir, trace=True, strategy=strategy)
 
     assert reduction['failed'] == failing
     assert reduction['modules'] == [get_module(polluter)]
@@ -237,3 +266,484 @@ def test_reduce_polluter_test_in_single_module(tests_dir, r):
     assert reduction['failed'] == f"{str(test)}::test_failing"
     assert reduction['modules'] == []
     assert reduction['tests'] == [f"{str(test)}::test_polluter"]
+
+
+def test_get_unit():
+    failing = 'test.py::TestFoo::test_foo[1]'
+    assert 'test.py::TestBar' == reduce._get_unit('test.py::TestBar::test_bar[1]', 0, failing)
+    assert 'test.py::test_bar' == reduce._get_unit('test.py::test_bar[a::b]', 0, failing)
+    assert 'test.py::TestFoo::test_bar' == reduce._get_unit('test.py::TestFoo::test_bar[1]', 0, failing)
+    assert 'test.py::TestFoo::test_foo[2]' == reduce._get_unit('test.py::TestFoo::test_foo[2]', 0, failing)
+    assert 'test.py::TestBar::test_bar[1]' == reduce._get_unit('test.py::TestBar::test_bar[1]', 2, failing)
+
+
+def test_split_point():
+    assert 2 == reduce._split_point([0, 0, 0, 0, 0])
+    assert 2 == reduce._split_point([1, 1, 1, 1, 1])
+    assert 1 == reduce._split_point([10, 1, 1, 1, 1])
+    assert 4 == reduce._split_point([1, 1, 1, 1, 10])
+    assert 3 == reduce._split_point([1, 2, 3, 4, 2])
+    assert 1 == reduce._split_point([1, 5])
+    assert 1 == reduce._split_point([5, 1])
+
+
+def test_bisect_items_by_cost():
+    costs = {'a': 1, 'b': 1, 'c': 1, 'd': 1, 'e': 1, 'f': 1, 'g': 30}
+    tried = []
+
+    def fails(items):
+        tried.append(items[:-1])
+        return 'c' in items
+
+    assert ['c'] == reduce._bisect_items(list(costs), 'failing', fails, progress=lambda n: None,
+                                         cost=costs.get)
+    # the slow item is split off by itself, and never needs to run
+    assert tried[0] == ['a', 'b', 'c', 'd', 'e', 'f']
+    assert not any('g' in items for items in tried)
+
+@pytest.mark.parametrize("r", [reduce.reduce, cli_reduce])
+def test_reduce_parametrized_polluter(tests_dir, r):
+    seq2p(tests_dir, 0).write_text(dedent("""\
+        import pytest
+        import sys
+
+        class TestPolluter:
+            @pytest.mark.parametrize("x", range(20))
+            def test_maybe_pollute(self, x):
+                if x == 13:
+                    sys.needs_this = True
+
+            def test_nothing(self):
+                pass
+
+        @pytest.mark.parametrize("x", range(10))
+        def test_nothing(x):
+            pass
+        """))
+
+    failing = seq2p(tests_dir, 1)
+    failing.write_text(dedent("""\
+        import sys
+
+        def test_failing():
+            assert not hasattr(sys, 'needs_this')
+        """))
+
+    reduction = r(tests_path=tests_dir, trace=True)
+
+    assert reduction['failed'] == f"{failing}::test_failing"
+    assert reduction['tests'] == [f"{seq2p(tests_dir, 0)}::TestPolluter::test_maybe_pollute[13]"]
+
+
+@pytest.mark.parametrize("max_runs", [99, 200])
+def test_flaky_trials_rarely_failing_baseline(max_runs):
+    # the baseline failed only once, leaving p_fail at (or below) the spurious failure rate
+    flaky = reduce.FlakyTrials.from_baseline(lambda count: [False] * count, max_runs=max_runs)
+    assert flaky.p_fail > reduce.FlakyTrials.P_SPURIOUS
+
+    counts = []
+    def run(count):
+        counts.append(count)
+        return [False] * count
+
+    assert not flaky.fails(run)
+    assert all(count >= 1 for count in counts) and sum(counts) <= max_runs
+    assert flaky.fails(lambda count: [True] * count)
+
+
+def test_flaky_trials_confidence():
+    flaky = reduce.FlakyTrials(.5)
+    flaky.decisions = [.9, .8, .7, .6]
+    assert flaky.confidence() == pytest.approx(.3024)
+    assert flaky.confidence(0, 2) == pytest.approx(.72)
+    assert flaky.confidence(2) == pytest.approx(.42)
+
+
+@pytest.mark.parametrize("pollute_in_collect", [True, False])
+def test_reduce_flaky(tests_dir, monkeypatch, pollute_in_collect):
+    failing, polluter, tests = make_polluted_suite(tests_dir, pollute_in_collect=pollute_in_collect,
+                                                   fail_collect=False)
+
+    # only fails every other time it runs polluted
+    Path(failing.split('::')[0]).write_text(dedent("""\
+        import sys
+        from pathlib import Path
+
+        def test_failing():
+            if getattr(sys, 'foobar', False):
+                count = Path('count.txt')
+                n = int(count.read_text()) if count.exists() else 0
+                count.write_text(str(n+1))
+                assert n % 2
+        """))
+
+    # note each decision's stage
+    stage = None
+    decisions = {'modules': [], 'tests': []}
+    fails = reduce.FlakyTrials.fails
+    def recording_fails(self, run):
+        result = fails(self, run)
+        if stage:
+            decisions[stage].append(self.decisions[-1])
+        return result
+
+    def on_event(event):
+        nonlocal stage
+        if event['event'] == 'stage':
+            stage = event['stage']
+
+    monkeypatch.setattr(reduce.FlakyTrials, "fails", recording_fails)
+    reduction = reduce.reduce(tests_path=tests_dir, flaky=True, flaky_runs=4, jobs=1, on_event=on_event)
+
+    assert reduction['failed'] == failing
+    assert reduction['modules'] == [get_module(polluter)]
+    assert reduction['tests'] == ([] if pollute_in_collect else [polluter])
+
+    # an item's confidence is that of the decisions that led to it
+    modules_confidence = math.prod(decisions['modules'])
+    assert reduction['confidence'][get_module(polluter)] == pytest.approx(modules_confidence, abs=1e-4)
+    if not pollute_in_collect:
+        assert decisions['tests']
+        assert reduction['confidence'][polluter] == \
+               pytest.approx(modules_confidence * math.prod(decisions['tests']), abs=1e-4)
+
+
+def test_run_pytest_durations_and_timeout(tests_dir):
+    test1 = seq2p(tests_dir, 1)
+    test1.write_text(dedent("""\
+        import time
+
+        def test_one():
+            time.sleep(.5)
+
+        def test_two():
+            pass
+        """))
+
+    r = reduce.run_pytest(tests_dir)
+    assert r.get_duration(f"{test1}::test_one") >= .5
+    assert r.get_duration(f"{test1}") > 0
+    assert r.get_expected_duration() >= .5
+    assert r.get_expected_duration(tests=[f"{test1}::test_two"]) < .5
+
+    r = reduce.run_pytest(tests_dir, timeout=.2)
+    assert r.get_outcome(f"{test1}::test_one") == 'timeout'
+
+
+@pytest.mark.parametrize("timeout_means", ['inconclusive', 'fails'])
+def test_reduce_trial_hangs(tests_dir, timeout_means):
+    failing, polluter, tests = make_polluted_suite(tests_dir, pollute_in_collect=True, fail_collect=False,
+                                                   polluter_seq=3, failing_seq=8)
+
+    seq2p(tests_dir, 0).write_text(dedent("""\
+        import sys
+        sys.guard = True
+
+        def test_nothing():
+            pass
+        """))
+
+    # hangs if the module above isn't present
+    seq2p(tests_dir, 2).write_text(dedent("""\
+        import sys
+        import time
+
+        def test_hangs():
+            if not hasattr(sys, 'guard'):
+                time.sleep(600)
+        """))
+
+    # with equal durations, the bisection doesn't depend on how long each module happened to take
+    baseline = reduce.run_pytest(tests_dir, ('-x',)).get_data()
+    baseline['durations'] = dict.fromkeys(baseline['durations'], .01)
+
+    reduction = reduce.reduce(tests_path=tests_dir, results=Results.from_data(baseline), trace=True,
+                              trial_timeout_min=5, timeout_means=timeout_means)
+
+    assert reduction['failed'] == failing
+    if timeout_means == 'inconclusive':
+        assert get_module(polluter) in reduction['modules']
+    else:
+        assert reduction['modules'] == [str(seq2p(tests_dir, 2))]
+
+
+@pytest.mark.parametrize("timeout_means", ['inconclusive', 'fails'])
+def test_reduce_failing_hangs_by_itself(tests_dir, timeout_means):
+    failing, polluter, tests = make_polluted_suite(tests_dir, pollute_in_collect=True, fail_collect=False,
+                                                   polluter_seq=3, failing_seq=8)
+
+    seq2p(tests_dir, 0).write_text(dedent("""\
+        import sys
+        sys.guard = True
+
+        def test_nothing():
+            pass
+        """))
+
+    # hangs if the module above isn't present
+    seq2p(tests_dir, 8).write_text(dedent("""\
+        import sys
+        import time
+
+        def test_failing():
+            if not hasattr(sys, 'guard'):
+                time.sleep(600)
+            assert not getattr(sys, 'foobar', False)
+        """))
+
+    reduction = reduce.reduce(tests_path=tests_dir, trace=True, trial_timeout_min=5,
+                              timeout_means=timeout_means)
+
+    assert reduction['failed'] == f"{seq2p(tests_dir, 8)}::test_failing"
+    if timeout_means == 'inconclusive':
+        assert 'error' not in reduction
+        assert get_module(polluter) in reduction['modules']
+    else:
+        assert reduction['error'] == 'Test also fails by itself'
+
+
+def test_reduce_async_shared_executor(tests_dir):
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+
+    failing, polluter, tests = make_polluted_suite(tests_dir, pollute_in_collect=True, fail_collect=False)
+
+    async def collect(**kwargs):
+        return [event async for event in reduce.reduce_async(tests_path=tests_dir, **kwargs)]
+
+    async def main(executor, cache):
+        return await asyncio.gather(collect(executor=executor, cache=cache),
+                                    collect(executor=executor, cache=cache))
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        runs = asyncio.run(main(executor, reduce.TrialCache()))
+
+    for events in runs:
+        kinds = [e['event'] for e in events]
+        assert kinds[0] == 'running'
+        assert 'stage' in kinds and 'step' in kinds
+        assert kinds[-2:] == ['reduced', 'done']
+
+        reduction = events[-1]['reduction']
+        assert reduction['failed'] == failing
+        assert reduction['modules'] == [get_module(polluter)]
+        assert reduction['tests'] == []
+
+
+def test_reduce_scan_jobs(tests_dir):
+    failing, polluter, tests = make_polluted_suite(tests_dir, pollute_in_collect=True, fail_collect=False,
+                                                   polluter_seq=6, failing_seq=9)
+
+    # the checkpoint after collecting only the first module is slow
+    Path(failing.split('::')[0]).write_text(dedent("""\
+        import sys
+        import time
+
+        def test_failing():
+            slow = 'test_00' in sys.modules and 'test_01' not in sys.modules
+            with open('checkpoints.txt', 'a') as f: f.write(f"{slow} {time.time()}\\n")
+            time.sleep(2 if slow else .2)
+            with open('checkpoints.txt', 'a') as f: f.write(f"{slow} {time.time()}\\n")
+            assert not getattr(sys, 'foobar', False)
+        """))
+
+    reduction = reduce.reduce(tests_path=tests_dir, strategy='scan', jobs=2)
+    assert reduction['failed'] == failing
+    assert reduction['modules'] == [get_module(polluter)]
+
+    # other checkpoints run while the slow one does, rather than waiting for it
+    events = [line.split() for line in Path('checkpoints.txt').read_text().splitlines()]
+    slow_start, slow_end = [float(t) for slow, t in events if slow == 'True']
+    assert sum(slow_start < float(t) < slow_end for slow, t in events if slow == 'False') >= 4
+
+
+@pytest.mark.parametrize("pollute_in_collect", [False, True])
+def test_reduce_scan_needs_two_polluters(tests_dir, pollute_in_collect):
+    for seq, attr in [(2, 'foo'), (5, 'bar')]:
+        if pollute_in_collect:
+            seq2p(tests_dir, seq).write_text(dedent(f"""\
+                import sys
+                sys.{attr} = True
+
+                def test_nothing():
+                    pass
+                """))
+        else:
+            seq2p(tests_dir, seq).write_text(dedent(f"""\
+                import sys
+
+                def test_pollute():
+                    sys.{attr} = True
+                """))
+
+    for seq in (0, 1, 3, 4, 6):
+        seq2p(tests_dir, seq).write_text('def test_foo(): pass')
+
+    failing = seq2p(tests_dir, 7)
+    failing.write_text(dedent("""\
+        import sys
+
+        def test_failing():
+            assert not (getattr(sys, 'foo', False) and getattr(sys, 'bar', False))
+        """))
+
+    events = []
+    reduction = reduce.reduce(tests_path=tests_dir, strategy='scan', on_event=events.append)
+
+    # the scan finds the last polluter, but that isn't enough by itself, so we bisect
+    assert [e['polluter'] for e in events if e['event'] == 'scanned'] == \
+           [str(seq2p(tests_dir, 5)) if pollute_in_collect else f"{seq2p(tests_dir, 5)}::test_pollute"]
+    assert reduction['failed'] == f"{failing}::test_failing"
+    assert {str(seq2p(tests_dir, 2)), str(seq2p(tests_dir, 5))} <= set(reduction['modules'])
+
+
+@pytest.mark.parametrize("r", [reduce.reduce, cli_reduce])
+def test_reduce_queue_workers(tests_dir, r):
+    failing, polluter, tests = make_polluted_suite(tests_dir, pollute_in_collect=False, fail_collect=False)
+
+    queue = tests_dir.parent / "queue"
+    workers = [subprocess.Popen([sys.executable, '-m', 'pytest_cleanslate.reduce', '--worker', queue,
+                                 *(('--jobs', '2') if i == 0 else ())])
+               for i in range(3)]
+    try:
+        if r is cli_reduce:
+            reduction = cli_reduce(tests_path=tests_dir, trace=True, queue=queue)
+        else:
+            executor = reduce.QueueExecutor(queue)
+            try:
+                reduction = reduce.reduce(tests_path=tests_dir, trace=True, executor=executor)
+            finally:
+                executor.shutdown()
+    finally:
+        for w in workers:
+            w.kill()
+            w.wait()
+
+    assert reduction['failed'] == failing
+    assert reduction['modules'] == [get_module(polluter)]
+    assert reduction['tests'] == [polluter]
+    assert not any(any((queue / subdir).iterdir()) for subdir in ('pending', 'claimed', 'done'))
+
+
+def test_queue_executor_lapsed_claim_and_shutdown(tmp_path):
+    queue = tmp_path / "queue"
+    executor = reduce.QueueExecutor(queue, poll_interval=.05, lease=.5)
+    future = executor.submit(reduce.run_pytest, tmp_path, timeout=10)
+    [spec] = (queue / "pending").iterdir()
+
+    # a worker claims the trial, but dies without renewing its claim
+    assert reduce._claim_trial(queue) is not None
+    assert not (queue / "pending" / spec.name).exists()
+
+    deadline = time.time() + 10
+    while not (queue / "pending" / spec.name).exists() and time.time() < deadline:
+        time.sleep(.05)
+    assert (queue / "pending" / spec.name).exists()
+
+    # without workers, the trial never completes; shutdown withdraws it rather than wait
+    executor.shutdown()
+    assert future.cancelled()
+    assert not any(any((queue / subdir).iterdir()) for subdir in ('pending', 'claimed', 'done'))
+
+
+def make_dependent_suite(tests_dir: Path) -> T.Tuple[str, str, str, str]:
+    """Makes a suite with a polluted test and a test that depends on another to pass."""
+    for seq in range(8):
+        seq2p(tests_dir, seq).write_text(dedent("""\
+            def test_a():
+                pass
+
+            def test_b():
+                pass
+            """))
+
+    polluter = seq2p(tests_dir, 1)
+    polluter.write_text(dedent("""\
+        import sys
+
+        def test_a():
+            sys.foo = True
+
+        def test_b():
+            pass
+        """))
+
+    polluted = seq2p(tests_dir, 5)
+    polluted.write_text(dedent("""\
+        import sys
+
+        def test_a():
+            assert not getattr(sys, 'foo', False)
+
+        def test_b():
+            sys.bar = True
+        """))
+
+    needs_setter = seq2p(tests_dir, 7)
+    needs_setter.write_text(dedent("""\
+        import sys
+
+        def test_a():
+            assert getattr(sys, 'bar', False)
+
+        def test_b():
+            pass
+        """))
+
+    return f"{polluted}::test_a", f"{polluter}::test_a", f"{needs_setter}::test_a", f"{polluted}::test_b"
+
+
+def cli_discover(*, tests_path: Path, **args) -> dict:
+    discovery_file = tests_path.parent / "discovery.json"
+
+    subprocess.run([sys.executable, '-m', 'pytest_cleanslate.reduce', '--discover',
+                    '--save-to', discovery_file,
+                    *(f"--{name}={value}" for name, value in args.items()),
+                    tests_path], check=True)
+
+    with discovery_file.open("r") as f:
+        return json.load(f)
+
+
+@pytest.mark.parametrize("d", [reduce.discover, cli_discover])
+def test_discover(tests_dir, d):
+    polluted, polluter, needs_setter, setter = make_dependent_suite(tests_dir)
+
+    discovery = d(tests_path=tests_dir, seed=1)
+
+    assert sorted(discovery['dependencies'], key=lambda dep: dep['victim']) == [
+        {'victim': polluted, 'kind': 'polluter', 'tests': [polluter]},
+        {'victim': needs_setter, 'kind': 'setter', 'tests': [setter]},
+    ]
+
+
+def test_discover_nothing_depends(tests_dir):
+    for seq in range(4):
+        seq2p(tests_dir, seq).write_text('def test_foo(): pass')
+
+    discovery = reduce.discover(tests_path=tests_dir, seed=1)
+
+    assert discovery['dependencies'] == []
+
+
+@pytest.mark.parametrize("r", [reduce.reduce, cli_reduce])
+def test_reduce_known_polluter(tests_dir, r):
+    failing, polluter, tests = make_polluted_suite(tests_dir, pollute_in_collect=False, fail_collect=False)
+
+    dependencies_file = tests_dir.parent / "dependencies.json"
+    dependencies_file.write_text(json.dumps({'dependencies': [
+        # no longer a polluter
+        {'victim': failing, 'kind': 'polluter', 'tests': [f"{get_module(polluter)}::test_bar"]},
+        {'victim': failing, 'kind': 'polluter', 'tests': [polluter]},
+    ]}))
+
+    events = []
+    reduction = r(tests_path=tests_dir, dependencies=dependencies_file,
+                  **({'on_event': events.append} if r is reduce.reduce else {}))
+
+    if r is reduce.reduce:
+        assert [e['polluters'] for e in events if e['event'] == 'known'] == [[polluter]]
+        assert not any(e['event'] == 'stage' for e in events)
+    assert reduction['failed'] == failing
+    assert reduction['modules'] == [get_module(polluter)]
+    assert reduction['tests'] == [polluter]